@@ -0,0 +1,124 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Tuple
+from pydantic import BaseModel
+from datetime import date, datetime, timedelta
+
+from app.core.config import settings
+from app.db.session import get_session
+from app.services.rollup_service import rollup_service
+from app.services.test_result_service import test_result_service
+
+router = APIRouter()
+
+class TrendPoint(BaseModel):
+    day: date
+    runs: int
+    success: int
+    failure: int
+    aborted: int
+    pass_rate: Optional[float] = None
+    duration_p50: Optional[int] = None
+    duration_p95: Optional[int] = None
+    tests_total: int
+    tests_passed: int
+    tests_failed: int
+    tests_skipped: int
+    test_pass_rate: Optional[float] = None
+
+class BackfillResult(BaseModel):
+    start: date
+    end: date
+    days: int
+    rollups: int
+    executions: int
+
+class TestRun(BaseModel):
+    execution_id: int
+    build_number: Optional[int] = None
+    run_at: datetime
+    status: str
+    duration: Optional[int] = None
+    name: str
+    full_name: str
+
+class FlakyTest(BaseModel):
+    test_id: str
+    name: Optional[str] = None
+    suite: Optional[str] = None
+    runs: int
+    failures: int
+    flips: int
+    flip_rate: float
+
+class SlowTest(BaseModel):
+    test_id: str
+    name: Optional[str] = None
+    suite: Optional[str] = None
+    runs: int
+    avg_duration: float
+    max_duration: int
+
+def resolve_range(start: Optional[date], end: Optional[date], default_days: int) -> Tuple[date, date]:
+    end = end or date.today()
+    start = start or end - timedelta(days=default_days - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days + 1 > settings.ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {settings.ANALYTICS_MAX_DAYS} days")
+    return start, end
+
+@router.get("/trends", response_model=List[TrendPoint])
+async def read_trends(
+    template_id: Optional[int] = None,
+    env: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    session: AsyncSession = Depends(get_session)
+):
+    """Daily pass rate, duration and test-case trends, read from the rollups only."""
+    start, end = resolve_range(start, end, 30)
+    return await rollup_service.get_trends(session, start, end, template_id, env)
+
+@router.post("/rollups/backfill", response_model=BackfillResult)
+async def backfill_rollups(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    session: AsyncSession = Depends(get_session)
+):
+    """Rebuild the rollups of a date range from the executions table (e.g. after an upgrade)."""
+    start, end = resolve_range(start, end, settings.ANALYTICS_BACKFILL_DAYS)
+    result = await rollup_service.backfill(session, start, end)
+    return BackfillResult(start=start, end=end, **result)
+
+@router.get("/templates/{template_id}/tests/flaky", response_model=List[FlakyTest])
+async def read_flaky_tests(
+    template_id: int,
+    days: int = Query(30, ge=1, le=366),
+    runs: int = Query(200, ge=2, le=1000),
+    min_runs: int = Query(5, ge=2),
+    limit: int = Query(50, ge=1, le=500),
+    session: AsyncSession = Depends(get_session)
+):
+    """Tests whose outcome flips most often over their last `runs` results."""
+    return await test_result_service.get_flaky(session, template_id, days, runs, min_runs, limit)
+
+@router.get("/templates/{template_id}/tests/slowest", response_model=List[SlowTest])
+async def read_slowest_tests(
+    template_id: int,
+    days: int = Query(7, ge=1, le=366),
+    limit: int = Query(20, ge=1, le=500),
+    session: AsyncSession = Depends(get_session)
+):
+    """Tests with the highest average duration."""
+    return await test_result_service.get_slowest(session, template_id, days, limit)
+
+@router.get("/templates/{template_id}/tests/{test_id}/history", response_model=List[TestRun])
+async def read_test_history(
+    template_id: int,
+    test_id: str,
+    limit: int = Query(200, ge=1, le=1000),
+    session: AsyncSession = Depends(get_session)
+):
+    """Results of one test case in its last `limit` runs, newest first."""
+    return await test_result_service.get_history(session, template_id, test_id, limit)
@@ -1,14 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlmodel import select, desc
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from pydantic import BaseModel
+import base64
 import json
 from datetime import datetime
 
+from app.core.config import settings
 from app.db.session import get_session
-from app.models.models import TestTemplate, TaskExecution, TaskStatus, TriggerType
+from app.models.models import TestTemplate, TaskExecution, TaskStatus, TriggerOutbox, TriggerType
+from app.services.allure_service import allure_service
+from app.services.cache_service import catalog_cache
+from app.services.event_hub import event_hub
 from app.services.jenkins_service import jenkins_service
+from app.services.leader_service import leader_elector
+from app.services.notification_dispatcher import notification_dispatcher
+from app.services.poller_service import status_poller
+from app.services.rollup_service import rollup_service
+from app.services.shard_service import shard_coordinator
+from app.services.trigger_dispatcher import trigger_dispatcher
 
 router = APIRouter()
 
@@ -17,12 +31,43 @@ class TriggerRequest(BaseModel):
     env: Optional[str] = None
     auto_notify: Optional[bool] = None
 
+def build_job_params(template: TestTemplate, env: str, overrides: Optional[dict] = None) -> dict:
+    try:
+        job_params = json.loads(template.params) if template.params else {}
+    except json.JSONDecodeError:
+        job_params = {}
+    job_params.update(overrides or {})
+    job_params["env"] = env
+    return job_params
+
+async def find_idempotent_executions(session: AsyncSession, keys: List[str]) -> dict:
+    """Executions already created for the given idempotency keys, keyed by key."""
+    if not keys:
+        return {}
+    result = await session.execute(
+        select(TriggerOutbox.idempotency_key, TaskExecution)
+        .join(TaskExecution, TaskExecution.id == TriggerOutbox.execution_id)
+        .where(TriggerOutbox.idempotency_key.in_(keys))
+    )
+    return {key: execution for key, execution in result.all()}
+
 @router.post("/trigger", response_model=TaskExecution)
 async def trigger_task(
     request: TriggerRequest,
-    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     session: AsyncSession = Depends(get_session)
 ):
+    """
+    Create a PENDING execution; the trigger dispatcher sends it to Jenkins.
+
+    Repeating a request with the same `Idempotency-Key` header returns the execution
+    created the first time instead of starting another build.
+    """
+    if idempotency_key:
+        existing = await find_idempotent_executions(session, [idempotency_key])
+        if idempotency_key in existing:
+            return existing[idempotency_key]
+
     # 1. Get Template
     template = await session.get(TestTemplate, request.template_id)
     if not template:
@@ -39,10 +84,10 @@ async def trigger_task(
     # Determine Notification logic
     should_notify = request.auto_notify if request.auto_notify is not None else template.auto_notify
 
-    # 3. Create Execution Record (QUEUED)
+    # 3. Create Execution Record (PENDING) and its outbox entry in one transaction
     execution = TaskExecution(
         template_id=template.id,
-        status=TaskStatus.QUEUED,
+        status=TaskStatus.PENDING,
         trigger_type=TriggerType.MANUAL,
         should_notify=should_notify,
         execution_env=target_env,
@@ -50,50 +95,278 @@ async def trigger_task(
         template_name=template.name
     )
     session.add(execution)
-    await session.commit()
-    await session.refresh(execution)
-
-    # 4. Call Jenkins
+    await session.flush()
+    trigger_dispatcher.enqueue(
+        session, execution, template.jenkins_job_name, build_job_params(template, target_env), idempotency_key
+    )
     try:
-        job_params = json.loads(template.params) if template.params else {}
-    except json.JSONDecodeError:
-        job_params = {}
-    
-    job_params["env"] = target_env
-    
-    queue_url = await jenkins_service.trigger_job(template.jenkins_job_name, job_params)
-    
-    if queue_url:
-        execution.jenkins_queue_item_url = queue_url
-        session.add(execution)
-        await session.commit()
-        await session.refresh(execution)
-    else:
-        execution.status = TaskStatus.FAILURE
-        execution.duration = 0
-        session.add(execution)
         await session.commit()
-        await session.refresh(execution)
-        raise HTTPException(status_code=500, detail="Failed to trigger Jenkins Job")
+    except IntegrityError:
+        # A concurrent request with the same idempotency key won
+        await session.rollback()
+        existing = await find_idempotent_executions(session, [idempotency_key] if idempotency_key else [])
+        if idempotency_key in existing:
+            return existing[idempotency_key]
+        raise
 
+    event_hub.publish_execution("execution.created", execution)
+    trigger_dispatcher.notify()
     return execution
 
+class BulkTriggerItem(BaseModel):
+    template_id: int
+    env: Optional[str] = None
+    params: Optional[dict] = None  # merged over the template's params
+    auto_notify: Optional[bool] = None
+
+class BulkTriggerRequest(BaseModel):
+    items: List[BulkTriggerItem]
+
+class BulkTriggerResult(BaseModel):
+    template_id: int
+    env: Optional[str] = None
+    execution_id: Optional[int] = None
+    status: Optional[TaskStatus] = None
+    error: Optional[str] = None
+
+def fill_from_execution(result: BulkTriggerResult, execution: TaskExecution):
+    result.env = execution.execution_env
+    result.execution_id = execution.id
+    result.status = execution.status
+
+@router.post("/trigger/bulk", response_model=List[BulkTriggerResult])
+async def trigger_bulk(
+    request: BulkTriggerRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Trigger many template/env combinations at once.
+
+    All executions and their outbox entries are inserted in one transaction; the trigger
+    dispatcher then sends them to Jenkins. Results are returned in request order. With an
+    `Idempotency-Key` header, item N uses the key `<key>:<N>`, so a retried request only
+    creates the items that were not created before.
+    """
+    if len(request.items) > settings.BULK_TRIGGER_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BULK_TRIGGER_MAX_ITEMS} items per request")
+
+    keys = [f"{idempotency_key}:{index}" if idempotency_key else None for index in range(len(request.items))]
+    existing = await find_idempotent_executions(session, [key for key in keys if key])
+    templates = await catalog_cache.get_templates(session, {item.template_id for item in request.items})
+    results = [BulkTriggerResult(template_id=item.template_id, env=item.env) for item in request.items]
+
+    pending = []
+    for item, result, key in zip(request.items, results, keys):
+        if key in existing:
+            fill_from_execution(result, existing[key])
+            continue
+        template = templates.get(item.template_id)
+        if not template:
+            result.error = "Template not found"
+            continue
+        result.env = item.env if item.env else template.default_env
+        execution = TaskExecution(
+            template_id=template.id,
+            status=TaskStatus.PENDING,
+            trigger_type=TriggerType.MANUAL,
+            should_notify=item.auto_notify if item.auto_notify is not None else template.auto_notify,
+            execution_env=result.env,
+            triggered_by="admin",  # Placeholder
+            template_name=template.name
+        )
+        pending.append((item, result, template, execution, key))
+
+    if not pending:
+        return results
+
+    session.add_all([execution for _, _, _, execution, _ in pending])
+    await session.flush()
+    for item, result, template, execution, key in pending:
+        trigger_dispatcher.enqueue(
+            session, execution, template.jenkins_job_name, build_job_params(template, result.env, item.params), key
+        )
+    await session.execute(
+        update(TestTemplate.__table__)
+        .where(TestTemplate.__table__.c.id.in_({template.id for _, _, template, _, _ in pending}))
+        .values(last_used=datetime.now())
+    )
+    try:
+        await session.commit()
+    except IntegrityError:
+        # A concurrent retry with the same idempotency key won: report the executions it stored
+        await session.rollback()
+        pending_keys = [key for _, _, _, _, key in pending]
+        existing = await find_idempotent_executions(session, [key for key in pending_keys if key])
+        if not all(key in existing for key in pending_keys):
+            raise
+        for _, result, _, _, key in pending:
+            fill_from_execution(result, existing[key])
+        return results
+
+    for _, result, _, execution, _ in pending:
+        result.execution_id = execution.id
+        result.status = execution.status
+        event_hub.publish_execution("execution.created", execution)
+    trigger_dispatcher.notify()
+    return results
+
 @router.get("/running", response_model=List[TaskExecution])
 async def get_running_tasks(
     session: AsyncSession = Depends(get_session)
 ):
     statement = select(TaskExecution).where(
+        (TaskExecution.status == TaskStatus.PENDING) |
         (TaskExecution.status == TaskStatus.QUEUED) | 
         (TaskExecution.status == TaskStatus.RUNNING)
     )
     result = await session.execute(statement)
     return result.scalars().all()
 
+# Heavy JSON columns left out of list responses unless include_stats=true
+HEAVY_COLUMNS = ("stats", "suite_stats")
+
+def encode_cursor(execution: TaskExecution) -> str:
+    raw = f"{execution.start_time.isoformat()}|{execution.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        start_time, execution_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(start_time), int(execution_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/recent", response_model=List[TaskExecution])
 async def get_recent_history(
-    limit: int = 20,
+    response: Response,
+    limit: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = None,
+    template_id: Optional[int] = None,
+    env: Optional[str] = None,
+    status: Optional[TaskStatus] = None,
+    trigger_type: Optional[TriggerType] = None,
+    start_from: Optional[datetime] = None,
+    start_to: Optional[datetime] = None,
+    include_stats: bool = True,
     session: AsyncSession = Depends(get_session)
 ):
-    statement = select(TaskExecution).order_by(desc(TaskExecution.start_time)).limit(limit)
+    """
+    Execution history, newest first, with keyset pagination.
+
+    Pass the `X-Next-Cursor` response header back as `cursor` to get the next page.
+    """
+    if include_stats:
+        statement = select(TaskExecution)
+    else:
+        columns = [c for c in TaskExecution.__table__.c if c.name not in HEAVY_COLUMNS]
+        statement = select(*columns)
+
+    if template_id is not None:
+        statement = statement.where(TaskExecution.template_id == template_id)
+    if env:
+        statement = statement.where(TaskExecution.execution_env == env)
+    if status:
+        statement = statement.where(TaskExecution.status == status)
+    if trigger_type:
+        statement = statement.where(TaskExecution.trigger_type == trigger_type)
+    if start_from:
+        statement = statement.where(TaskExecution.start_time >= start_from)
+    if start_to:
+        statement = statement.where(TaskExecution.start_time < start_to)
+    if cursor:
+        cursor_time, cursor_id = decode_cursor(cursor)
+        statement = statement.where(or_(
+            TaskExecution.start_time < cursor_time,
+            and_(TaskExecution.start_time == cursor_time, TaskExecution.id < cursor_id)
+        ))
+
+    # One extra row tells whether there is a next page
+    statement = statement.order_by(desc(TaskExecution.start_time), desc(TaskExecution.id)).limit(limit + 1)
     result = await session.execute(statement)
-    return result.scalars().all()
+    if include_stats:
+        executions = result.scalars().all()
+    else:
+        executions = [TaskExecution(**row._mapping) for row in result.all()]
+
+    if len(executions) > limit:
+        executions = executions[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(executions[-1])
+    return executions
+
+@router.get("/stream")
+async def stream_execution_events(
+    request: Request,
+    template_id: Optional[List[int]] = Query(None),
+    status: Optional[List[TaskStatus]] = Query(None),
+    env: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+    resume_from: Optional[str] = None
+):
+    """
+    Server-sent events of execution status changes.
+
+    Reconnecting clients send `Last-Event-ID` (browsers do this automatically) or
+    `resume_from` and receive only the events they missed.
+    """
+    subscriber = event_hub.subscribe(
+        template_ids=set(template_id) if template_id else None,
+        statuses={s.value for s in status} if status else None,
+        env=env,
+        last_event_id=last_event_id or resume_from,
+    )
+
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                events = await subscriber.next_batch(timeout=settings.EVENT_HEARTBEAT)
+                if not events:
+                    yield ": heartbeat\n\n"
+                    continue
+                for event in events:
+                    yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            event_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/executions/{execution_id}/allure-summary")
+async def get_allure_summary(
+    execution_id: int,
+    session: AsyncSession = Depends(get_session)
+):
+    """Parsed Allure summary of an execution, from the DB or the in-process report cache."""
+    execution = await session.get(TaskExecution, execution_id)
+    if not execution:
+        raise HTTPException(status_code=404, detail="Execution not found")
+    if execution.stats is not None:
+        return {"stats": execution.stats, "suite_stats": execution.suite_stats}
+
+    template = await session.get(TestTemplate, execution.template_id)
+    summary = None
+    if template and execution.build_number and execution.allure_report_url:
+        summary = await allure_service.get_summary(
+            template.jenkins_job_name, execution.build_number, execution.allure_report_url
+        )
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Allure report not available yet")
+    return summary
+
+@router.get("/metrics")
+async def get_metrics():
+    """Runtime metrics of the background services."""
+    return {
+        "leader": leader_elector.get_metrics(),
+        "jenkins_pool": jenkins_service.get_pool_metrics(),
+        "trigger_outbox": trigger_dispatcher.get_metrics(),
+        "poller": status_poller.get_metrics(),
+        "poller_shards": {**shard_coordinator.get_metrics(), "shards": await shard_coordinator.get_shards()},
+        "allure": allure_service.get_metrics(),
+        "rollups": rollup_service.get_metrics(),
+        "event_stream": event_hub.get_metrics(),
+        "notifications": notification_dispatcher.get_metrics(),
+    }
@@ -4,7 +4,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
 from app.db.session import get_session
-from app.models.models import NotificationConfig
+from app.models.models import NotificationConfig, NotificationDeadLetter
+from app.services.cache_service import catalog_cache
 from app.services.notification_service import notification_service
 
 router = APIRouter()
@@ -29,6 +30,18 @@ async def read_notification_configs(
     configs = result.scalars().all()
     return configs
 
+@router.get("/dead-letters", response_model=List[NotificationDeadLetter])
+async def read_dead_letters(
+    skip: int = 0,
+    limit: int = 100,
+    session: AsyncSession = Depends(get_session)
+):
+    """Notifications that could not be delivered after all retries, newest first."""
+    result = await session.execute(
+        select(NotificationDeadLetter).order_by(NotificationDeadLetter.id.desc()).offset(skip).limit(limit)
+    )
+    return result.scalars().all()
+
 @router.get("/{config_id}", response_model=NotificationConfig)
 async def read_notification_config(
     config_id: int, 
@@ -57,6 +70,7 @@ async def update_notification_config(
     session.add(config)
     await session.commit()
     await session.refresh(config)
+    catalog_cache.invalidate_notification_config(config_id)
     return config
 
 @router.delete("/{config_id}")
@@ -69,6 +83,7 @@ async def delete_notification_config(
         raise HTTPException(status_code=404, detail="Notification Config not found")
     await session.delete(config)
     await session.commit()
+    catalog_cache.invalidate_notification_config(config_id)
     return {"ok": True}
 
 @router.post("/test", response_model=bool)
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -37,6 +37,18 @@ async def read_schedules(
     result = await session.execute(select(ScheduleConfig).offset(skip).limit(limit))
     return result.scalars().all()
 
+class NextFireTime(BaseModel):
+    schedule_id: int
+    next_fire_time: Optional[datetime] = None
+
+@router.get("/next-fire-times", response_model=List[NextFireTime])
+async def read_next_fire_times():
+    """When each active schedule fires next, as registered in the scheduler."""
+    return [
+        NextFireTime(schedule_id=schedule_id, next_fire_time=next_fire_time)
+        for schedule_id, next_fire_time in (await scheduler_service.get_next_fire_times()).items()
+    ]
+
 @router.get("/{schedule_id}", response_model=ScheduleConfig)
 async def read_schedule(
     schedule_id: int, 
@@ -80,7 +92,7 @@ async def delete_schedule(
     if not schedule:
         raise HTTPException(status_code=404, detail="Schedule not found")
     
-    scheduler_service.remove_job(schedule.id)
+    await scheduler_service.remove_job(schedule.id)
     
     await session.delete(schedule)
     await session.commit()
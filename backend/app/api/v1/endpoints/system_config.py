@@ -1,12 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import select
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 from datetime import datetime
 
 from app.db.session import get_session
 from app.models.models import SystemConfig
+from app.services.cache_service import catalog_cache
 
 router = APIRouter()
 
@@ -34,26 +34,26 @@ async def create_system_config(
     session.add(db_config)
     await session.commit()
     await session.refresh(db_config)
+    catalog_cache.invalidate_system_configs()
     return db_config
 
 @router.get("/", response_model=SystemConfigResponse)
 async def get_system_configs(
+    response: Response,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
     session: AsyncSession = Depends(get_session)
 ):
-    statement = select(SystemConfig)
-    results = await session.execute(statement)
-    configs = results.scalars().all()
-    
-    # Group by type_name
-    grouped_data = {}
-    for config in configs:
-        if config.type_name not in grouped_data:
-            grouped_data[config.type_name] = []
-        grouped_data[config.type_name].append(config.value)
-    
-    # Format as requested: [{"Type1": ["val1", "val2"]}, ...]
-    data_list = []
-    for type_name, values in grouped_data.items():
-        data_list.append({type_name: values})
-        
-    return {"data": data_list}
+    """
+    Config values grouped by type: [{"Type1": ["val1", "val2"]}, ...]
+
+    Served from the in-process cache with an ETag; a matching `If-None-Match` gets 304.
+    """
+    data, etag = await catalog_cache.get_system_configs(session)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    ):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return {"data": data}
@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Any
+from typing import List, Any, Optional
 
 from app.db.session import get_session
 from app.models.models import TestTemplate
+from app.services.cache_service import catalog_cache
 from app.services.jenkins_service import jenkins_service
 
 router = APIRouter()
@@ -30,9 +31,34 @@ async def read_templates(
     return templates
 
 @router.get("/jenkins-jobs", response_model=List[Any])
-async def get_jenkins_jobs():
-    """Helper to fetch available jobs from Jenkins."""
-    return await jenkins_service.get_jobs()
+async def get_jenkins_jobs(
+    response: Response,
+    q: Optional[str] = None,
+    folder: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Jobs available in Jenkins (folders flattened), from the cached job catalogue.
+
+    `q` matches the full job name case-insensitively, `folder` keeps the jobs of a
+    folder and its subfolders. The total number of matches is in `X-Total-Count`.
+    """
+    jobs = await jenkins_service.get_job_catalogue()
+    if folder:
+        prefix = folder.strip("/") + "/"
+        jobs = [job for job in jobs if job["name"].startswith(prefix)]
+    if q:
+        needle = q.lower()
+        jobs = [job for job in jobs if needle in job["name"].lower()]
+    response.headers["X-Total-Count"] = str(len(jobs))
+    return jobs[skip:skip + limit]
+
+@router.post("/jenkins-jobs/refresh")
+async def refresh_jenkins_jobs():
+    """Reload the job catalogue from Jenkins now."""
+    jobs = await jenkins_service.get_job_catalogue(refresh=True)
+    return {"jobs": len(jobs)}
 
 @router.get("/{template_id}", response_model=TestTemplate)
 async def read_template(
@@ -62,6 +88,7 @@ async def update_template(
     session.add(template)
     await session.commit()
     await session.refresh(template)
+    catalog_cache.invalidate_template(template_id)
     return template
 
 @router.delete("/{template_id}")
@@ -74,4 +101,5 @@ async def delete_template(
         raise HTTPException(status_code=404, detail="Template not found")
     await session.delete(template)
     await session.commit()
+    catalog_cache.invalidate_template(template_id)
     return {"ok": True}
@@ -0,0 +1,111 @@
+import hmac
+from datetime import datetime
+from typing import Optional, Set
+from urllib.parse import unquote, urlparse
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from pydantic import BaseModel
+from sqlalchemy import or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.core.config import settings
+from app.db.session import get_session
+from app.models.models import TaskExecution, TaskStatus, TestTemplate
+from app.services.transition_service import FINISHED_STATUSES, Transition, transition_service
+from app.services.trigger_dispatcher import trigger_dispatcher
+
+router = APIRouter()
+
+class JenkinsBuildEvent(BaseModel):
+    number: Optional[int] = None
+    queue_id: Optional[int] = None
+    phase: str  # QUEUED / STARTED / COMPLETED / FINALIZED
+    status: Optional[str] = None  # SUCCESS / FAILURE / ABORTED / UNSTABLE ...
+    duration: Optional[int] = None
+
+class JenkinsNotification(BaseModel):
+    """Payload of the Jenkins Notification plugin (JSON format); generic senders use the same shape."""
+    name: str
+    url: Optional[str] = None  # "job/team/job/api-tests/"; absolute URLs are accepted too
+    build: JenkinsBuildEvent
+
+def job_names(payload: JenkinsNotification) -> Set[str]:
+    """Names the job may be configured under: the payload name and the full name from its URL."""
+    names = {payload.name}
+    if payload.url:
+        parts = urlparse(payload.url).path.strip("/").split("/")
+        full_name = []
+        # One "job/<name>" pair per folder level, after any context path
+        start = parts.index("job") if "job" in parts else len(parts)
+        for i in range(start, len(parts) - 1, 2):
+            if parts[i] != "job":
+                break
+            full_name.append(unquote(parts[i + 1]))
+        if full_name:
+            names.add("/".join(full_name))
+    return names
+
+def verify_webhook_secret(
+    x_webhook_token: Optional[str] = Header(None),
+    token: Optional[str] = None
+):
+    if not settings.WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Webhook is disabled")
+    supplied = x_webhook_token or token or ""
+    if not hmac.compare_digest(supplied.encode(), settings.WEBHOOK_SECRET.encode()):
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+
+@router.post("/jenkins", dependencies=[Depends(verify_webhook_secret)])
+async def receive_jenkins_event(
+    payload: JenkinsNotification,
+    session: AsyncSession = Depends(get_session)
+):
+    build = payload.build
+
+    # Match by queue id first (known right after trigger), then by job + build number
+    conditions = []
+    if build.queue_id is not None:
+        conditions.append(TaskExecution.jenkins_queue_item_url.like(f"%/queue/item/{build.queue_id}/"))
+        conditions.append(TaskExecution.jenkins_queue_item_url.like(f"%/queue/item/{build.queue_id}"))
+    if build.number is not None:
+        conditions.append(
+            TestTemplate.jenkins_job_name.in_(job_names(payload)) & (TaskExecution.build_number == build.number)
+        )
+    if not conditions:
+        raise HTTPException(status_code=422, detail="Event carries neither queue_id nor build number")
+
+    statement = (
+        select(TaskExecution, TestTemplate)
+        .join(TestTemplate, TestTemplate.id == TaskExecution.template_id)
+        .where(TaskExecution.status.in_([TaskStatus.QUEUED, TaskStatus.RUNNING]), or_(*conditions))
+    )
+    rows = (await session.execute(statement)).all()
+
+    now = datetime.now()
+    phase = build.phase.upper()
+    transitions = []
+    for task, template in rows:
+        session.expunge(task)
+        values = {"last_event_at": now}
+        if phase in ("COMPLETED", "FINALIZED"):
+            build_number = build.number or task.build_number
+            if build_number is None:
+                # Unknown build (no report URL): left to the poller, which resolves the queue item
+                continue
+            build_info = {"result": build.status, "duration": build.duration or 0}
+            values.update(transition_service.completion_values(template, build_number, build_info))
+            values["build_number"] = build_number
+        elif phase == "STARTED" and task.status == TaskStatus.QUEUED:
+            if build.number is None:
+                continue
+            values.update(status=TaskStatus.RUNNING, build_number=build.number)
+        if task.status == TaskStatus.QUEUED and "status" in values:
+            values.update(queue_position=None, queue_reason=None)
+        transitions.append(Transition(task, template, task.status, values))
+
+    applied = await transition_service.apply(session, transitions)
+    await transition_service.on_applied(session, applied)
+    if any(t.task.status in FINISHED_STATUSES for t in applied):
+        trigger_dispatcher.notify()
+    return {"matched": len(rows), "applied": len(applied)}
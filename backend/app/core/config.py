@@ -21,6 +21,107 @@ class Settings(BaseSettings):
     JENKINS_URL: str = "http://192.168.1.100:8080"
     JENKINS_USER: str = "admin"
     JENKINS_PASS: str = "admin"
+    # Shared HTTP client (connection pool / keep-alive)
+    JENKINS_TIMEOUT: float = 10.0
+    JENKINS_MAX_CONNECTIONS: int = 50
+    JENKINS_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    JENKINS_KEEPALIVE_EXPIRY: float = 30.0
+    JENKINS_HTTP2: bool = False  # requires the optional `h2` package
+    # How many recent builds a batched per-job status query returns
+    JENKINS_BUILDS_WINDOW: int = 50
+    JENKINS_CRUMB_TTL: float = 1800.0  # seconds a CSRF crumb is reused before refetching
+    JENKINS_JOBS_TTL: float = 300.0  # job catalogue age before it is refreshed in the background
+    JENKINS_JOBS_FOLDER_DEPTH: int = 3  # folder levels expanded by the catalogue tree query
+
+    # Status poller
+    POLLER_TICK: float = 2.0  # max sleep between cycles; new executions are picked up within one tick
+    POLLER_MIN_INTERVAL: float = 2.0  # per-task check interval right after trigger / near expected finish
+    POLLER_MAX_INTERVAL: float = 60.0  # per-task check interval cap while backing off
+    POLLER_BACKOFF_FACTOR: float = 2.0
+    POLLER_HISTORY_TTL: float = 600.0  # how long a template's historical duration is reused
+    POLLER_CONCURRENCY: int = 20  # max concurrent Jenkins calls per poll cycle
+    POLLER_SHARDS: int = 1  # in-flight executions are split by template_id % POLLER_SHARDS across instances
+    POLLER_SHARD_LEASE_TTL: float = 15.0
+    POLLER_SHARD_HEARTBEAT: float = 5.0
+    POLLER_CALL_TIMEOUT: float = 15.0  # budget for a single Jenkins call
+
+    # In-process cache of templates / notification configs (safety net for other replicas' writes)
+    CATALOG_CACHE_TTL: float = 60.0
+
+    # Jenkins build-event webhook (Notification plugin / generic JSON POST)
+    WEBHOOK_SECRET: str = ""  # shared secret; the endpoint rejects every call while empty
+    WEBHOOK_QUIET_PERIOD: float = 300.0  # seconds the poller skips a task after a pushed event
+
+    # Allure summary ingestion (background workers)
+    ALLURE_WORKERS: int = 4
+    ALLURE_QUEUE_SIZE: int = 1000
+    ALLURE_MAX_RETRIES: int = 5
+    ALLURE_RETRY_DELAY: float = 10.0  # doubled on every retry
+    ALLURE_FETCH_SUITES: bool = True
+    ALLURE_CACHE_SIZE: int = 2000
+    ALLURE_STORE_TEST_CASES: bool = True  # per-test results into testcaseresult (needs ALLURE_FETCH_SUITES)
+    ALLURE_TEST_CASE_BATCH: int = 1000  # rows per INSERT
+
+    # Dashboard live event stream (SSE)
+    EVENT_HISTORY_SIZE: int = 1000  # events kept for resuming clients
+    EVENT_CLIENT_BUFFER: int = 200  # per-client buffer, oldest dropped when full
+    EVENT_HEARTBEAT: float = 15.0
+    EVENT_POLL_INTERVAL: float = 0.5  # how often each instance reads events written by the others
+    EVENT_BATCH_SIZE: int = 500  # events written / read per statement
+    EVENT_GAP_TIMEOUT: float = 5.0  # a missing event id (uncommitted or rolled back insert) is waited for this long
+    EVENT_RETENTION: int = 3600  # seconds events are kept in the executionevent table
+
+    # Leader election: one instance runs the scheduler and trigger dispatcher
+    INSTANCE_ID: str = ""  # empty = <hostname>-<pid>
+    LEADER_LEASE_TTL: float = 15.0  # a dead leader is replaced at most this long (+ one heartbeat) after its last renewal
+    LEADER_HEARTBEAT: float = 5.0
+
+    # Scheduler (jobs persisted in the DB; empty URL = DATABASE_URL with a sync driver)
+    SCHEDULER_JOBSTORE_URL: str = ""
+    SCHEDULER_MISFIRE_GRACE_TIME: int = 300  # seconds a missed run may still fire late (e.g. after a restart)
+    SCHEDULER_COALESCE: bool = True  # several missed runs of one schedule fire once
+    SCHEDULER_SYNC_INTERVAL: float = 30.0  # picks up schedules edited through other instances
+
+    # Bulk trigger
+    BULK_TRIGGER_MAX_ITEMS: int = 500
+
+    # Trigger outbox (durable queue of Jenkins build triggers)
+    OUTBOX_POLL_INTERVAL: float = 1.0
+    OUTBOX_BATCH_SIZE: int = 100  # rows read per claim
+    OUTBOX_CONCURRENCY: int = 10  # concurrent buildWithParameters calls
+    OUTBOX_MAX_IN_FLIGHT_PER_JOB: int = 4
+    OUTBOX_MAX_ATTEMPTS: int = 5
+    OUTBOX_RETRY_DELAY: float = 2.0  # doubled on every retry
+    OUTBOX_CLAIM_TIMEOUT: float = 120.0  # claims older than this (dead process) are released
+    # Build parameter carrying the trigger's idempotency key; declare it as a string parameter
+    # on the jobs so retries can find a build Jenkins already accepted
+    OUTBOX_TRIGGER_KEY_PARAM: str = "AUTOTASK_TRIGGER_KEY"
+
+    # Caps on builds queued/running in Jenkins at once (0 = unlimited); excess executions stay PENDING.
+    # Templates can set their own cap with TestTemplate.max_concurrent.
+    MAX_CONCURRENT_BUILDS: int = 0
+    MAX_CONCURRENT_BUILDS_PER_JOB: int = 0
+
+    # Notification dispatch queue
+    NOTIFY_WORKERS: int = 8
+    NOTIFY_QUEUE_SIZE: int = 5000
+    NOTIFY_CHANNEL_CONCURRENCY: int = 4  # concurrent sends per channel type (FEISHU / DINGTALK / EMAIL)
+    NOTIFY_RATE_PER_SECOND: float = 1.0  # per notification config (bot webhook rate limits)
+    NOTIFY_RATE_BURST: int = 5
+    NOTIFY_MAX_RETRIES: int = 5
+    NOTIFY_RETRY_DELAY: float = 2.0  # doubled on every retry
+    NOTIFY_DIGEST_WINDOW: float = 30.0  # seconds completions are buffered per config; 0 sends each one at once
+    NOTIFY_DIGEST_MAX_ITEMS: int = 50  # a full buffer is flushed before the window ends
+    NOTIFY_SHUTDOWN_GRACE: float = 5.0
+    NOTIFY_HTTP_TIMEOUT: float = 10.0
+    NOTIFY_KEEPALIVE_EXPIRY: float = 30.0  # idle webhook connections are closed after this
+    SMTP_TIMEOUT: float = 10.0
+    SMTP_IDLE_TIMEOUT: float = 60.0  # pooled SMTP sessions idle longer than this are reopened before use
+
+    # Analytics rollups (template x env x day)
+    ANALYTICS_BACKFILL_DAYS: int = 90  # default range of a backfill
+    ANALYTICS_MAX_DAYS: int = 366  # widest range accepted by the trends and backfill APIs
+    ROLLUP_DELAY: float = 2.0  # completions gathered before their rollups are recomputed in one batch
 
     class Config:
         case_sensitive = True
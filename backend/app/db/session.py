@@ -14,6 +14,7 @@ async def get_session() -> AsyncSession:
         yield session
 
 from sqlalchemy import text
+from app.models.models import TaskExecution
 
 async def init_db():
     async with engine.begin() as conn:
@@ -52,3 +53,51 @@ async def init_db():
             await conn.execute(text("ALTER TABLE taskexecution ADD COLUMN template_name VARCHAR(255)"))
         except Exception:
             pass
+        try:
+            await conn.execute(text("ALTER TABLE taskexecution ADD COLUMN last_event_at DATETIME"))
+        except Exception:
+            pass
+        try:
+            await conn.execute(text("ALTER TABLE taskexecution ADD COLUMN queue_position INT"))
+        except Exception:
+            pass
+        try:
+            await conn.execute(text("ALTER TABLE taskexecution ADD COLUMN queue_reason VARCHAR(255)"))
+        except Exception:
+            pass
+        try:
+            await conn.execute(text("ALTER TABLE testtemplate ADD COLUMN max_concurrent INT"))
+        except Exception:
+            pass
+        # pollershard.shard_id was created AUTO_INCREMENT: drop it and the rows it misnumbered
+        try:
+            await conn.execute(text("ALTER TABLE pollershard MODIFY COLUMN shard_id INT NOT NULL"))
+        except Exception:
+            pass
+        try:
+            await conn.execute(
+                text("DELETE FROM pollershard WHERE shard_id >= :shards"), {"shards": settings.POLLER_SHARDS}
+            )
+        except Exception as e:
+            print(f"Migration warning: {e}")
+        # notificationdeadletter text columns were created as VARCHAR(255)
+        for column, null in (("title", "NOT NULL"), ("content", "NOT NULL"), ("last_error", "NULL")):
+            try:
+                await conn.execute(text(f"ALTER TABLE notificationdeadletter MODIFY COLUMN {column} TEXT {null}"))
+            except Exception:
+                pass
+        # New PENDING status (executions waiting in the trigger outbox)
+        try:
+            await conn.execute(text(
+                "ALTER TABLE taskexecution MODIFY COLUMN status "
+                "ENUM('PENDING','QUEUED','RUNNING','SUCCESS','FAILURE','ABORTED') NOT NULL"
+            ))
+        except Exception:
+            pass
+
+        # Indexes declared on TaskExecution (create_all only adds them to new tables)
+        for index in TaskExecution.__table__.indexes:
+            try:
+                await conn.run_sync(lambda sync_conn: index.create(sync_conn, checkfirst=True))
+            except Exception as e:
+                print(f"Migration warning: {e}")
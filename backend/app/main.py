@@ -2,9 +2,19 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
 from app.core.config import settings
-from app.api.v1.endpoints import notifications, templates, dashboard, schedules, system_config
+from app.api.v1.endpoints import notifications, templates, dashboard, schedules, system_config, webhooks, analytics
 from app.db.session import init_db
 from app.services.poller_service import status_poller
+from app.services.jenkins_service import jenkins_service
+from app.services.leader_service import leader_elector
+from app.services.allure_service import allure_service
+from app.services.event_hub import event_hub
+from app.services.notification_dispatcher import notification_dispatcher
+from app.services.notification_service import notification_service
+from app.services.rollup_service import rollup_service
+from app.services.scheduler_service import scheduler_service
+from app.services.shard_service import shard_coordinator
+from app.services.trigger_dispatcher import trigger_dispatcher
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -18,13 +28,43 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag"],
 )
 
+# Background work that must run in exactly one instance
+async def start_leader_services():
+    await trigger_dispatcher.start()
+    await scheduler_service.start()
+
+async def stop_leader_services():
+    scheduler_service.stop()
+    await trigger_dispatcher.stop()
+
 @app.on_event("startup")
 async def on_startup():
     await init_db()
+    await event_hub.start()
+    await jenkins_service.start()
+    await allure_service.start()
+    await rollup_service.start()
+    await notification_dispatcher.start()
+    await leader_elector.start(start_leader_services, stop_leader_services)
+    # Every instance polls the shards it leases
+    await shard_coordinator.start()
     asyncio.create_task(status_poller.start())
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    await status_poller.stop()
+    await shard_coordinator.stop()
+    await leader_elector.stop()
+    await event_hub.stop()
+    await allure_service.stop()
+    await rollup_service.stop()
+    await notification_dispatcher.stop()
+    await notification_service.close()
+    await jenkins_service.close()
+
 @app.get("/")
 def root():
     return {"message": "Welcome to TestFlow Pro API"}
@@ -34,3 +74,5 @@ app.include_router(templates.router, prefix=f"{settings.API_V1_STR}/templates",
 app.include_router(dashboard.router, prefix=f"{settings.API_V1_STR}/dashboard", tags=["dashboard"])
 app.include_router(schedules.router, prefix=f"{settings.API_V1_STR}/schedules", tags=["schedules"])
 app.include_router(system_config.router, prefix=f"{settings.API_V1_STR}/system-configs", tags=["system-configs"])
+app.include_router(webhooks.router, prefix=f"{settings.API_V1_STR}/webhooks", tags=["webhooks"])
+app.include_router(analytics.router, prefix=f"{settings.API_V1_STR}/analytics", tags=["analytics"])
@@ -1,8 +1,8 @@
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 from sqlmodel import SQLModel, Field, Relationship, Column
-from sqlalchemy import JSON
+from sqlalchemy import JSON, Index, Text
 
 class NotificationType(str, Enum):
     FEISHU = "FEISHU"
@@ -10,6 +10,7 @@ class NotificationType(str, Enum):
     EMAIL = "EMAIL"
 
 class TaskStatus(str, Enum):
+    PENDING = "PENDING"  # waiting in the trigger outbox, not sent to Jenkins yet
     QUEUED = "QUEUED"
     RUNNING = "RUNNING"
     SUCCESS = "SUCCESS"
@@ -20,6 +21,12 @@ class TriggerType(str, Enum):
     MANUAL = "MANUAL"
     SCHEDULE = "SCHEDULE"
 
+class OutboxStatus(str, Enum):
+    PENDING = "PENDING"
+    IN_FLIGHT = "IN_FLIGHT"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
 class NotificationConfig(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
@@ -40,6 +47,7 @@ class TestTemplate(SQLModel, table=True):
     params: str = Field(default="{}", description="JSON string parameters for Jenkins")
     auto_notify: bool = Field(default=False, description="Whether to send notifications automatically")
     last_used: Optional[datetime] = Field(default=None)
+    max_concurrent: Optional[int] = Field(default=None, description="Max builds queued/running in Jenkins at once, None for no limit")
     
     notification_ids: List[int] = Field(default=[], sa_column=Column(JSON))
     
@@ -59,6 +67,12 @@ class ScheduleConfig(SQLModel, table=True):
     template: Optional[TestTemplate] = Relationship(back_populates="schedules")
 
 class TaskExecution(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_taskexecution_status_start_time", "status", "start_time"),
+        Index("ix_taskexecution_template_id_start_time", "template_id", "start_time"),
+        Index("ix_taskexecution_start_time_id", "start_time", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     template_id: int = Field(foreign_key="testtemplate.id")
     build_number: Optional[int] = None
@@ -73,13 +87,120 @@ class TaskExecution(SQLModel, table=True):
     suite_stats: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
     triggered_by: Optional[str] = None
     jenkins_queue_item_url: Optional[str] = None
+    # While QUEUED: 1-based position in the Jenkins build queue and why it is waiting
+    queue_position: Optional[int] = None
+    queue_reason: Optional[str] = None
     template_name: Optional[str] = None
+    # Last build event pushed by Jenkins (webhook); the poller leaves such tasks alone for a while
+    last_event_at: Optional[datetime] = None
 
     stats: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
     
     # Relationships
     template: Optional[TestTemplate] = Relationship(back_populates="executions")
 
+class ExecutionRollup(SQLModel, table=True):
+    """Finished executions of one template in one env on one day, kept up to date as executions finish."""
+    __table_args__ = (
+        Index("ux_executionrollup_template_id_env_day", "template_id", "env", "day", unique=True),
+        Index("ix_executionrollup_day", "day"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    template_id: int = Field(foreign_key="testtemplate.id")
+    env: str = ""  # execution_env, "" when unknown
+    day: date
+    runs: int = 0
+    success: int = 0
+    failure: int = 0
+    aborted: int = 0
+    # Build durations in ms (nearest-rank percentiles)
+    duration_p50: Optional[int] = None
+    duration_p95: Optional[int] = None
+    # Test cases from the Allure summaries of the day's runs
+    tests_total: int = 0
+    tests_passed: int = 0
+    tests_failed: int = 0  # failed + broken
+    tests_skipped: int = 0
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+class TestCaseResult(SQLModel, table=True):
+    """Result of one test case in one execution, from the Allure report."""
+    __table_args__ = (
+        Index("ix_testcaseresult_template_id_test_id_run_at", "template_id", "test_id", "run_at"),
+        Index("ix_testcaseresult_template_id_run_at", "template_id", "run_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    execution_id: int = Field(foreign_key="taskexecution.id", index=True)
+    template_id: int = Field(foreign_key="testtemplate.id")
+    test_id: str = Field(max_length=40)  # sha1 of full_name, stable across runs
+    name: str = Field(max_length=255)
+    suite: Optional[str] = Field(default=None, max_length=255)
+    full_name: str = Field(sa_column=Column(Text))  # suite path / name [parameters]
+    status: str = Field(max_length=16)  # passed, failed, broken, skipped, unknown
+    duration: Optional[int] = None  # ms
+    run_at: datetime  # start time of the execution
+
+class TriggerOutbox(SQLModel, table=True):
+    """A Jenkins build trigger waiting to be sent, written in the same transaction as its execution."""
+    __table_args__ = (
+        Index("ix_triggeroutbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    execution_id: int = Field(foreign_key="taskexecution.id", index=True)
+    idempotency_key: str = Field(unique=True)
+    job_name: str
+    params: Dict[str, Any] = Field(default={}, sa_column=Column(JSON))
+    status: OutboxStatus = OutboxStatus.PENDING
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.now)
+    claimed_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.now)
+
+class LeaderLease(SQLModel, table=True):
+    """Lease row of a singleton role (e.g. the scheduler/poller leader), renewed by its holder."""
+    name: str = Field(primary_key=True)
+    holder: str
+    acquired_at: datetime = Field(default_factory=datetime.now)
+    expires_at: datetime
+
+class PollerShard(SQLModel, table=True):
+    """One partition of in-flight executions (template_id % POLLER_SHARDS) and the worker leasing it."""
+    # Explicit ids starting at 0: never AUTO_INCREMENT (MySQL would store shard 0 as the next id)
+    shard_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    owner: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    # Reported by the owner on every heartbeat
+    tracked_tasks: int = 0
+    lag_ms: float = 0.0
+    updated_at: Optional[datetime] = None
+
+class PollerWorker(SQLModel, table=True):
+    """A live poller worker; shards are spread over the workers with a recent heartbeat."""
+    worker_id: str = Field(primary_key=True)
+    heartbeat_at: datetime = Field(default_factory=datetime.now)
+
+class ExecutionEvent(SQLModel, table=True):
+    """An execution change for the dashboard stream; every instance relays these rows to its clients."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    event: str = Field(max_length=32)
+    data: Dict[str, Any] = Field(default={}, sa_column=Column(JSON))
+    created_at: datetime = Field(default_factory=datetime.now, index=True)
+
+class NotificationDeadLetter(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    config_id: Optional[int] = Field(default=None, index=True)
+    execution_id: Optional[int] = None
+    # Digest bodies and error texts easily exceed VARCHAR(255)
+    title: str = Field(sa_column=Column(Text, nullable=False))
+    content: str = Field(sa_column=Column(Text, nullable=False))
+    attempts: int = 0
+    last_error: Optional[str] = Field(default=None, sa_column=Column(Text))
+    created_at: datetime = Field(default_factory=datetime.now)
+
 class SystemConfig(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     type_name: str = Field(index=True)
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+from app.db.session import async_session
+from app.models.models import TaskExecution
+from app.services.jenkins_service import jenkins_service
+from app.services.rollup_service import rollup_service
+from app.services.test_result_service import test_result_service
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("passed", "failed", "broken", "skipped", "unknown")
+
+
+class AllureService:
+    """
+    Ingests Allure report summaries into finished executions.
+
+    Reports are fetched off the poll path by a small pool of workers fed from a bounded
+    queue, retried with backoff while the report is not published yet, and cached by
+    job + build so the same report is never downloaded twice.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._cache: "OrderedDict[Tuple[str, int], dict]" = OrderedDict()
+        self.metrics = {"ingested": 0, "retried": 0, "failed": 0, "dropped": 0, "cache_hits": 0, "test_cases": 0}
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=settings.ALLURE_QUEUE_SIZE)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(settings.ALLURE_WORKERS)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def get_metrics(self) -> dict:
+        return {
+            **self.metrics,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "cached_reports": len(self._cache),
+        }
+
+    def enqueue(self, execution_id: int, job_name: str, build_number: int, report_url: str, attempt: int = 0):
+        """Schedule ingestion of an execution's report; never blocks the caller."""
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait((execution_id, job_name, build_number, report_url, attempt))
+        except asyncio.QueueFull:
+            self.metrics["dropped"] += 1
+            logger.warning(f"Allure queue full, dropping summary of execution {execution_id}")
+
+    async def get_summary(self, job_name: str, build_number: int, report_url: str) -> Optional[dict]:
+        """Parsed {"stats", "suite_stats"} of a build's report, None while it is not published."""
+        key = (job_name, build_number)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.metrics["cache_hits"] += 1
+            return self._cache[key]
+        report = await self._fetch_report(job_name, build_number, report_url)
+        return report[0] if report else None
+
+    async def _fetch_report(self, job_name: str, build_number: int, report_url: str) -> Optional[Tuple[dict, list]]:
+        """Download a report: (parsed summary, test cases), or None while it is not published."""
+        base = report_url.rstrip("/")
+        summary = await jenkins_service.get_report_json(f"{base}/widgets/summary.json")
+        if summary is None:
+            return None
+        parsed = {
+            "stats": {"statistic": summary.get("statistic", {}), "time": summary.get("time", {})},
+            "suite_stats": None,
+        }
+        cases = []
+        if settings.ALLURE_FETCH_SUITES:
+            suites = await jenkins_service.get_report_json(f"{base}/data/suites.json")
+            if suites:
+                parsed["suite_stats"] = self._parse_suites(suites)
+                if settings.ALLURE_STORE_TEST_CASES:
+                    cases = test_result_service.parse_cases(suites)
+
+        # Test cases are not cached: they are stored once, on ingestion
+        self._cache[(job_name, build_number)] = parsed
+        if len(self._cache) > settings.ALLURE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return parsed, cases
+
+    def _parse_suites(self, suites: dict) -> dict:
+        """Per top-level suite status counts from the Allure suites tree."""
+        result = []
+        for suite in suites.get("children", []):
+            statistic = dict.fromkeys(STATUSES, 0)
+            self._count_leaves(suite, statistic)
+            statistic["total"] = sum(statistic[s] for s in STATUSES)
+            result.append({"name": suite.get("name"), "statistic": statistic})
+        return {"suites": result}
+
+    def _count_leaves(self, node: dict, statistic: dict):
+        children = node.get("children")
+        if children is None:
+            status = node.get("status", "unknown")
+            statistic[status if status in statistic else "unknown"] += 1
+            return
+        for child in children:
+            self._count_leaves(child, statistic)
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._ingest(*item)
+            except Exception as e:
+                logger.error(f"Error ingesting Allure summary of execution {item[0]}: {e}")
+                self._retry(item)
+            finally:
+                self._queue.task_done()
+
+    async def _ingest(self, execution_id: int, job_name: str, build_number: int, report_url: str, attempt: int):
+        if settings.ALLURE_STORE_TEST_CASES:
+            # The test cases are only in the downloaded report, so skip the summary cache
+            report = await self._fetch_report(job_name, build_number, report_url)
+        else:
+            parsed = await self.get_summary(job_name, build_number, report_url)
+            report = (parsed, []) if parsed else None
+        if report is None:
+            # Report not published yet (generated in a post-build step)
+            self._retry((execution_id, job_name, build_number, report_url, attempt))
+            return
+        parsed, cases = report
+
+        async with async_session() as session:
+            execution = await session.get(TaskExecution, execution_id)
+            if execution is None:
+                return
+            execution.stats = parsed["stats"]
+            execution.suite_stats = parsed["suite_stats"]
+            session.add(execution)
+            if cases:
+                await test_result_service.store(session, execution, cases)
+            await session.commit()
+            self.metrics["test_cases"] += len(cases)
+
+            # Test-case totals of the execution's day changed
+            rollup_service.enqueue([execution])
+        self.metrics["ingested"] += 1
+
+    def _retry(self, item: tuple):
+        execution_id, job_name, build_number, report_url, attempt = item
+        if attempt + 1 >= settings.ALLURE_MAX_RETRIES:
+            self.metrics["failed"] += 1
+            logger.warning(f"Giving up on Allure summary of execution {execution_id}")
+            return
+        self.metrics["retried"] += 1
+        delay = settings.ALLURE_RETRY_DELAY * (2 ** attempt)
+        asyncio.get_running_loop().call_later(
+            delay, self.enqueue, execution_id, job_name, build_number, report_url, attempt + 1
+        )
+
+allure_service = AllureService()
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import time
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import SQLModel, select
+
+from app.core.config import settings
+from app.models.models import NotificationConfig, SystemConfig, TestTemplate
+
+
+class CatalogCache:
+    """
+    In-process cache of templates and notification configs keyed by id, and of the
+    grouped system configs.
+
+    Entries are detached snapshots loaded with one `IN (...)` query per miss batch.
+    The write endpoints invalidate them; the TTL only covers writes made by other processes.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Type[SQLModel], Dict[int, tuple]] = {
+            TestTemplate: {},
+            NotificationConfig: {},
+        }
+        # (loaded at, grouped system configs, ETag)
+        self._system_configs: Optional[Tuple[float, List[Dict[str, List[str]]], str]] = None
+
+    async def _get_many(self, session: AsyncSession, model: Type[SQLModel], ids: Iterable[int]) -> dict:
+        entries = self._entries[model]
+        now = time.monotonic()
+        found, missing = {}, set()
+        for obj_id in set(ids):
+            entry = entries.get(obj_id)
+            if entry and now - entry[0] < settings.CATALOG_CACHE_TTL:
+                found[obj_id] = entry[1]
+            else:
+                missing.add(obj_id)
+
+        if missing:
+            result = await session.execute(select(model).where(model.id.in_(missing)))
+            for obj in result.scalars().all():
+                session.expunge(obj)
+                entries[obj.id] = (now, obj)
+                found[obj.id] = obj
+        return found
+
+    async def get_templates(self, session: AsyncSession, ids: Iterable[int]) -> Dict[int, TestTemplate]:
+        return await self._get_many(session, TestTemplate, ids)
+
+    async def get_notification_configs(self, session: AsyncSession, ids: Iterable[int]) -> Dict[int, NotificationConfig]:
+        return await self._get_many(session, NotificationConfig, ids)
+
+    def invalidate_template(self, template_id: Optional[int] = None):
+        if template_id is None:
+            self._entries[TestTemplate].clear()
+        else:
+            self._entries[TestTemplate].pop(template_id, None)
+
+    def invalidate_notification_config(self, config_id: Optional[int] = None):
+        if config_id is None:
+            self._entries[NotificationConfig].clear()
+        else:
+            self._entries[NotificationConfig].pop(config_id, None)
+
+    async def get_system_configs(self, session: AsyncSession) -> Tuple[List[Dict[str, List[str]]], str]:
+        """System config values grouped by type, [{"ENV": ["prod", ...]}, ...], and their ETag."""
+        entry = self._system_configs
+        if entry and time.monotonic() - entry[0] < settings.CATALOG_CACHE_TTL:
+            return entry[1], entry[2]
+
+        result = await session.execute(
+            select(SystemConfig.type_name, SystemConfig.value).order_by(SystemConfig.type_name, SystemConfig.id)
+        )
+        data = [
+            {type_name: [value for _, value in rows]}
+            for type_name, rows in groupby(result.all(), key=lambda row: row[0])
+        ]
+        # Derived from the content, so every instance hands out the same ETag
+        etag = '"' + hashlib.sha1(json.dumps(data, ensure_ascii=False).encode("utf-8")).hexdigest() + '"'
+        self._system_configs = (time.monotonic(), data, etag)
+        return data, etag
+
+    def invalidate_system_configs(self):
+        self._system_configs = None
+
+catalog_cache = CatalogCache()
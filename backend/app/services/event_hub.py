@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+
+from sqlalchemy import delete, func, insert
+from sqlmodel import select
+
+from app.core.config import settings
+from app.db.session import async_session
+from app.models.models import ExecutionEvent, TaskExecution
+
+logger = logging.getLogger(__name__)
+
+PRUNE_INTERVAL = 60.0
+
+
+class Subscriber:
+    """One connected client: a bounded buffer that drops its oldest events when the client lags."""
+
+    def __init__(
+        self, template_ids: Optional[Set[int]], statuses: Optional[Set[str]], env: Optional[str], after: int = 0
+    ):
+        self.template_ids = template_ids
+        self.statuses = statuses
+        self.env = env
+        # Resumed from another instance that may be ahead of this one: skip what the client has
+        self.after = after
+        self.buffer = deque(maxlen=settings.EVENT_CLIENT_BUFFER)
+        self.dropped = 0
+        self._ready = asyncio.Event()
+
+    def matches(self, event: dict) -> bool:
+        if event["seq"] <= self.after:
+            return False
+        data = event["data"]
+        if self.template_ids and data.get("template_id") not in self.template_ids:
+            return False
+        if self.statuses and data.get("status") not in self.statuses:
+            return False
+        if self.env and data.get("execution_env") != self.env:
+            return False
+        return True
+
+    def push(self, event: dict):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(event)
+        self._ready.set()
+
+    async def next_batch(self, timeout: float) -> List[dict]:
+        """Wait up to `timeout` seconds for events; an empty list means the wait timed out."""
+        if not self.buffer:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return []
+        events = list(self.buffer)
+        self.buffer.clear()
+        return events
+
+
+class EventHub:
+    """
+    Pub/sub of execution status changes for the dashboard stream, shared by all instances.
+
+    publish() only buffers an event; the relay task of the instance writes the buffer to the
+    ExecutionEvent table in one INSERT, and the relay of every instance reads the new rows
+    (right after its own writes, else every EVENT_POLL_INTERVAL seconds) and pushes them to
+    its subscribers. Triggers, polls and webhooks handled by any instance therefore reach
+    every client, and event ids are row ids that mean the same on every instance.
+
+    A short history lets reconnecting clients resume from their last id, on any instance;
+    ids older than the history get a `reset` event telling the client to reload the lists.
+    """
+
+    def __init__(self):
+        self._cursor = 0  # every event up to this id has been delivered (or given up on)
+        self._delivered: Set[int] = set()  # delivered ids above the cursor
+        self._gap_since: Optional[float] = None
+        self._history = deque(maxlen=settings.EVENT_HISTORY_SIZE)
+        self._subscribers: Set[Subscriber] = set()
+        # Written on the next relay cycle; bounded in case the database is unreachable
+        self._outgoing = deque(maxlen=settings.EVENT_HISTORY_SIZE)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._pruned_at = 0.0
+        self.metrics = {"written": 0, "relayed": 0, "skipped_gaps": 0, "errors": 0}
+
+    async def start(self):
+        if self._loop_task is not None:
+            return
+        async with async_session() as session:
+            # Only events from now on: history before the start cannot be resumed anyway
+            self._cursor = (await session.execute(select(func.max(ExecutionEvent.id)))).scalar() or 0
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        try:
+            # The other instances still relay what this one published last
+            await self._flush()
+        except Exception as e:
+            logger.error(f"Failed to write events on shutdown: {e}")
+
+    def publish_execution(self, event_type: str, execution: TaskExecution):
+        self.publish(event_type, {
+            "id": execution.id,
+            "template_id": execution.template_id,
+            "template_name": execution.template_name,
+            "status": execution.status.value if execution.status else None,
+            "build_number": execution.build_number,
+            "execution_env": execution.execution_env,
+            "trigger_type": execution.trigger_type.value if execution.trigger_type else None,
+            "start_time": execution.start_time.isoformat() if execution.start_time else None,
+            "duration": execution.duration,
+            "allure_report_url": execution.allure_report_url,
+            "queue_position": execution.queue_position,
+            "queue_reason": execution.queue_reason,
+        })
+
+    def publish(self, event_type: str, data: dict):
+        self._outgoing.append({"event": event_type, "data": data, "created_at": datetime.now()})
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def subscribe(
+        self,
+        template_ids: Optional[Set[int]] = None,
+        statuses: Optional[Set[str]] = None,
+        env: Optional[str] = None,
+        last_event_id: Optional[str] = None,
+    ) -> Subscriber:
+        after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+        subscriber = Subscriber(template_ids, statuses, env, after)
+        if last_event_id:
+            self._replay(subscriber, last_event_id)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def _replay(self, subscriber: Subscriber, last_event_id: str):
+        oldest = self._history[0]["seq"] if self._history else self._cursor + 1
+        if not last_event_id.isdigit() or int(last_event_id) + 1 < oldest:
+            # Events were lost (history overflow, or an id from before the upgrade): the client must reload
+            subscriber.after = 0
+            subscriber.push({"id": str(self._cursor), "seq": self._cursor, "event": "reset", "data": {}})
+            return
+        for event in self._history:
+            if subscriber.matches(event):
+                subscriber.push(event)
+
+    def get_metrics(self) -> dict:
+        return {
+            **self.metrics,
+            "subscribers": len(self._subscribers),
+            "last_event_id": str(self._cursor),
+            "unsent": len(self._outgoing),
+            "dropped_events": sum(s.dropped for s in self._subscribers),
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.EVENT_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._flush()
+                await self._relay()
+                if time.monotonic() - self._pruned_at > PRUNE_INTERVAL:
+                    await self._prune()
+            except Exception as e:
+                self.metrics["errors"] += 1
+                logger.error(f"Error in event relay: {e}")
+
+    async def _flush(self):
+        while self._outgoing:
+            batch = [self._outgoing.popleft() for _ in range(min(len(self._outgoing), settings.EVENT_BATCH_SIZE))]
+            try:
+                async with async_session() as session:
+                    await session.execute(insert(ExecutionEvent.__table__), batch)
+                    await session.commit()
+            except Exception:
+                # Kept for the next cycle
+                self._outgoing.extendleft(reversed(batch))
+                raise
+            self.metrics["written"] += len(batch)
+
+    async def _relay(self):
+        """Push the events written since the cursor, by any instance, to the local subscribers."""
+        while True:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(ExecutionEvent)
+                    .where(ExecutionEvent.id > self._cursor)
+                    .order_by(ExecutionEvent.id)
+                    .limit(settings.EVENT_BATCH_SIZE)
+                )
+                rows = result.scalars().all()
+            fresh = [row for row in rows if row.id not in self._delivered]
+            for row in fresh:
+                self._deliver({"id": str(row.id), "seq": row.id, "event": row.event, "data": row.data})
+                self._delivered.add(row.id)
+            self._advance()
+            if not fresh or len(rows) < settings.EVENT_BATCH_SIZE:
+                return
+
+    def _advance(self):
+        """
+        Move the cursor over the delivered ids. Ids are assigned before commit, so a missing
+        id may still show up (a slower transaction) or never will (rolled back); it is
+        waited for EVENT_GAP_TIMEOUT seconds before the cursor skips it.
+        """
+        while self._delivered:
+            if self._cursor + 1 in self._delivered:
+                self._cursor += 1
+                self._delivered.discard(self._cursor)
+                self._gap_since = None
+            elif self._gap_since is None:
+                self._gap_since = time.monotonic()
+                return
+            elif time.monotonic() - self._gap_since > settings.EVENT_GAP_TIMEOUT:
+                self._cursor = min(self._delivered) - 1
+                self._gap_since = None
+                self.metrics["skipped_gaps"] += 1
+            else:
+                return
+
+    def _deliver(self, event: dict):
+        self._history.append(event)
+        self.metrics["relayed"] += 1
+        for subscriber in self._subscribers:
+            if subscriber.matches(event):
+                subscriber.push(event)
+
+    async def _prune(self):
+        cutoff = datetime.now() - timedelta(seconds=settings.EVENT_RETENTION)
+        async with async_session() as session:
+            await session.execute(delete(ExecutionEvent).where(ExecutionEvent.created_at < cutoff))
+            await session.commit()
+        self._pruned_at = time.monotonic()
+
+event_hub = EventHub()
@@ -1,97 +1,339 @@
+import asyncio
 import json
+import time
+import logging
+from typing import List, Optional
+from urllib.parse import quote
+
 import httpx
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
+
 class JenkinsService:
     def __init__(self):
         self.base_url = settings.JENKINS_URL
         self.auth = (settings.JENKINS_USER, settings.JENKINS_PASS)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._http2 = False
+        # Pool metrics (cumulative since the client was created)
+        self._requests = 0
+        self._in_flight = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        # CSRF crumb, bound to the session cookie kept in the shared client's cookie jar
+        self._crumb: Optional[dict] = None
+        self._crumb_fetched_at = 0.0
+        self._crumb_lock = asyncio.Lock()
+        self._crumb_fetches = 0
+        # Job catalogue, served stale while a background refresh runs
+        self._jobs: Optional[List[dict]] = None
+        self._jobs_fetched_at = 0.0
+        self._jobs_checked_at = 0.0
+        self._jobs_refresh: Optional[asyncio.Task] = None
+        self._jobs_fetches = 0
 
-    async def get_jobs(self):
-        """Fetch all jobs from Jenkins."""
-        async with httpx.AsyncClient() as client:
-            try:
-                # Jenkins API to get jobs depth 1
-                url = f"{self.base_url}/api/json?tree=jobs[name,url,color]"
-                response = await client.get(url, auth=self.auth, timeout=10.0)
-                response.raise_for_status()
-                data = response.json()
-                return data.get("jobs", [])
-            except Exception as e:
-                print(f"Error fetching Jenkins jobs: {e}")
-                return []
+    def _http2_enabled(self) -> bool:
+        if not settings.JENKINS_HTTP2:
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("JENKINS_HTTP2 is set but the 'h2' package is not installed, falling back to HTTP/1.1")
+            return False
+        return True
 
-    async def trigger_job(self, job_name: str, params: dict = None):
-        async with httpx.AsyncClient() as client:
-            try:
-                base = self.base_url.rstrip('/')
-               # 1. 获取 Crumb
-                headers = {}
-                crumb_resp = await client.get(f"{base}/crumbIssuer/api/json", auth=self.auth)
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared client, creating it on first use."""
+        if self._client is None or self._client.is_closed:
+            limits = httpx.Limits(
+                max_connections=settings.JENKINS_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.JENKINS_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.JENKINS_KEEPALIVE_EXPIRY,
+            )
+            self._http2 = self._http2_enabled()
+            self._client = httpx.AsyncClient(
+                auth=self.auth,
+                limits=limits,
+                timeout=settings.JENKINS_TIMEOUT,
+                http2=self._http2,
+            )
+        return self._client
+
+    async def start(self):
+        self._get_client()
+
+    async def close(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._crumb = None
+        if self._jobs_refresh is not None:
+            self._jobs_refresh.cancel()
+            self._jobs_refresh = None
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request over the shared pool, recording how long it waited for a connection."""
+        client = self._get_client()
+        issued = time.monotonic()
+        waited = []
+
+        async def trace(event_name: str, info: dict):
+            # The first connect (new connection) or send (reused connection) ends the pool wait
+            if not waited and event_name.endswith((".connect_tcp.started", ".send_request_headers.started")):
+                waited.append(time.monotonic() - issued)
+
+        self._in_flight += 1
+        try:
+            return await client.request(method, url, extensions={"trace": trace}, **kwargs)
+        finally:
+            self._in_flight -= 1
+            self._requests += 1
+            if waited:
+                self._wait_time_total += waited[0]
+                self._wait_time_max = max(self._wait_time_max, waited[0])
+
+    def get_pool_metrics(self) -> dict:
+        connections = []
+        if self._client is not None and not self._client.is_closed:
+            pool = getattr(self._client._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {
+            "http2": self._http2,
+            "open_connections": len(connections),
+            "idle_connections": idle,
+            "active_connections": len(connections) - idle,
+            "max_connections": settings.JENKINS_MAX_CONNECTIONS,
+            "in_flight_requests": self._in_flight,
+            "total_requests": self._requests,
+            "avg_pool_wait_ms": round(self._wait_time_total / self._requests * 1000, 3) if self._requests else 0.0,
+            "max_pool_wait_ms": round(self._wait_time_max * 1000, 3),
+            "crumb_fetches": self._crumb_fetches,
+            "job_catalogue": {
+                "jobs": len(self._jobs) if self._jobs is not None else None,
+                "age_s": round(time.monotonic() - self._jobs_fetched_at, 1) if self._jobs is not None else None,
+                "fetches": self._jobs_fetches,
+            },
+        }
+
+    def job_path(self, job_name: str) -> str:
+        """URL path of a job by its full name: "team/api-tests" -> "team/job/api-tests"."""
+        return "/job/".join(quote(part, safe="") for part in job_name.strip("/").split("/"))
+
+    async def get_job_catalogue(self, refresh: bool = False) -> List[dict]:
+        """
+        Every job of the controller with folders flattened; `name` is the full name ("team/api-tests").
+
+        The list is cached. Once it is older than JENKINS_JOBS_TTL the cached list is still
+        returned while one background task refreshes it; only the first call (or `refresh`)
+        waits for Jenkins. A failed refresh keeps serving the previous list.
+        """
+        if refresh or self._jobs is None:
+            await self._refresh_jobs()
+        elif time.monotonic() - self._jobs_checked_at > settings.JENKINS_JOBS_TTL:
+            self._start_jobs_refresh()
+        return self._jobs or []
+
+    def _start_jobs_refresh(self) -> asyncio.Task:
+        # Single flight: concurrent callers share the running refresh
+        if self._jobs_refresh is None or self._jobs_refresh.done():
+            self._jobs_checked_at = time.monotonic()
+            self._jobs_refresh = asyncio.create_task(self._fetch_jobs())
+        return self._jobs_refresh
+
+    async def _refresh_jobs(self):
+        await asyncio.shield(self._start_jobs_refresh())
+
+    async def _fetch_jobs(self):
+        try:
+            # One tree query covering JENKINS_JOBS_FOLDER_DEPTH levels of folders
+            fields = "_class,name,url,color"
+            tree = f"jobs[{fields}]"
+            for _ in range(settings.JENKINS_JOBS_FOLDER_DEPTH):
+                tree = f"jobs[{fields},{tree}]"
+            response = await self._request("GET", f"{self.base_url.rstrip('/')}/api/json", params={"tree": tree})
+            response.raise_for_status()
+            jobs = []
+            self._flatten_jobs(response.json().get("jobs", []), [], jobs)
+            self._jobs = jobs
+            self._jobs_fetched_at = time.monotonic()
+            self._jobs_fetches += 1
+        except Exception as e:
+            print(f"Error fetching Jenkins jobs: {e}")
+
+    def _flatten_jobs(self, items: list, path: List[str], jobs: List[dict]):
+        for item in items:
+            full_path = path + [item.get("name", "")]
+            if "jobs" in item:
+                self._flatten_jobs(item["jobs"] or [], full_path, jobs)
+            elif not item.get("_class", "").endswith(("Folder", "MultiBranchProject")):
+                # Folders deeper than JENKINS_JOBS_FOLDER_DEPTH come without "jobs" and are left out
+                jobs.append({
+                    "_class": item.get("_class"),
+                    "name": "/".join(full_path),
+                    "folder": "/".join(path),
+                    "url": item.get("url"),
+                    "color": item.get("color"),
+                })
+
+    async def get_crumb_headers(self, stale: Optional[dict] = None) -> dict:
+        """
+        CSRF crumb header for POST requests (empty if the crumb issuer is disabled).
+
+        The crumb is cached for JENKINS_CRUMB_TTL seconds. Pass the headers that were
+        just rejected as `stale` to force a refresh; concurrent callers holding the same
+        stale crumb share one refetch.
+        """
+        async with self._crumb_lock:
+            expired = time.monotonic() - self._crumb_fetched_at > settings.JENKINS_CRUMB_TTL
+            if self._crumb is None or expired or (stale is not None and stale == self._crumb):
+                crumb = {}
+                crumb_resp = await self._request("GET", f"{self.base_url.rstrip('/')}/crumbIssuer/api/json")
                 if crumb_resp.status_code == 200:
                     c_data = crumb_resp.json()
-                    headers[c_data['crumbRequestField']] = c_data['crumb']
-                
-                # 2. 构造 URL
-                # 对于 Pipeline，最稳妥的方法是直接拼接到 URL 后面
-                endpoint = "buildWithParameters" if params else "build"
-                url = f"{base}/job/{job_name}/{endpoint}"
-
-                # 3. 发送 POST 请求
-                # 注意：params 参数在 httpx 中会处理成 URL 查询参数 (Query Params)
-                jenkins_params = {"parameter": [{"name": k, "value": v} for k, v in params.items()]}
-            
-                payload = {
-                    "json": json.dumps(jenkins_params),
-                    **params
-                }
-
-                # 3. 发送请求
-                response = await client.post(
-                    url, 
-                    auth=self.auth, 
-                    data=payload,
-                    headers=headers, 
-                    timeout=10.0
-                )
-                
-                if response.status_code in [200, 201]:
-                    # Return the queue item location header
-                    return response.headers.get("Location")
-                print(f"Failed: {response.status_code}")
-                return None
-            except Exception as e:
-                print(f"Error: {e}")
-                return None
+                    crumb = {c_data['crumbRequestField']: c_data['crumb']}
+                self._crumb = crumb
+                self._crumb_fetched_at = time.monotonic()
+                self._crumb_fetches += 1
+            return dict(self._crumb)
+
+    async def trigger_job(self, job_name: str, params: dict = None):
+        """Trigger a build and return its queue item URL."""
+        try:
+            base = self.base_url.rstrip('/')
+            # 1. 获取 Crumb (cached; refreshed once if Jenkins rejects it)
+            headers = await self.get_crumb_headers()
+
+            # 2. 构造 URL
+            # 对于 Pipeline，最稳妥的方法是直接拼接到 URL 后面
+            endpoint = "buildWithParameters" if params else "build"
+            url = f"{base}/job/{self.job_path(job_name)}/{endpoint}"
+
+            # 3. 发送 POST 请求
+            # 注意：params 参数在 httpx 中会处理成 URL 查询参数 (Query Params)
+            params = params or {}
+            jenkins_params = {"parameter": [{"name": k, "value": v} for k, v in params.items()]}
+
+            payload = {
+                "json": json.dumps(jenkins_params),
+                **params
+            }
+
+            # 3. 发送请求
+            response = await self._request("POST", url, data=payload, headers=headers)
+            if response.status_code == 403:
+                # Crumb expired or its session was invalidated
+                headers = await self.get_crumb_headers(stale=headers)
+                response = await self._request("POST", url, data=payload, headers=headers)
+
+            if response.status_code in [200, 201]:
+                # Return the queue item location header
+                return response.headers.get("Location")
+            print(f"Failed: {response.status_code}")
+            return None
+        except Exception as e:
+            print(f"Error: {e}")
+            return None
 
     async def get_build_info(self, job_name: str, build_number: int):
         """Get details of a specific build."""
-        async with httpx.AsyncClient() as client:
-            try:
-                url = f"{self.base_url}/job/{job_name}/{build_number}/api/json"
-                response = await client.get(url, auth=self.auth, timeout=10.0)
-                if response.status_code == 404:
-                    return None
-                response.raise_for_status()
-                return response.json()
-            except Exception as e:
-                print(f"Error fetching build info: {e}")
+        try:
+            url = f"{self.base_url}/job/{self.job_path(job_name)}/{build_number}/api/json"
+            response = await self._request("GET", url)
+            if response.status_code == 404:
                 return None
-                
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            print(f"Error fetching build info: {e}")
+            return None
+
+    async def get_job_builds(self, job_name: str, limit: Optional[int] = None):
+        """Fetch the most recent builds of a job with a single tree query."""
+        limit = limit or settings.JENKINS_BUILDS_WINDOW
+        try:
+            url = f"{self.base_url}/job/{self.job_path(job_name)}/api/json"
+            tree = f"builds[number,building,result,duration,queueId,timestamp]{{0,{limit}}}"
+            response = await self._request("GET", url, params={"tree": tree})
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.json().get("builds", [])
+        except Exception as e:
+            print(f"Error fetching builds of {job_name}: {e}")
+            return None
+
+    async def get_report_json(self, url: str):
+        """Fetch a JSON file published by a build (e.g. Allure report data). None if it does not exist."""
+        response = await self._request("GET", url)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    async def get_queue(self):
+        """Snapshot of the whole build queue in one request (None if Jenkins could not be reached)."""
+        try:
+            url = f"{self.base_url.rstrip('/')}/queue/api/json"
+            tree = "items[id,why,blocked,buildable,stuck,inQueueSince,task[name]]"
+            response = await self._request("GET", url, params={"tree": tree})
+            response.raise_for_status()
+            return response.json().get("items", [])
+        except Exception as e:
+            print(f"Error fetching build queue: {e}")
+            return None
+
+    async def find_triggered(self, job_name: str, param: str, value: str) -> Optional[str]:
+        """
+        Queue item URL of a build of the job triggered with `param` = `value`, looked up in
+        the queue and the last JENKINS_BUILDS_WINDOW builds; None if there is none.
+
+        Raises if Jenkins cannot be asked, so callers never take "unknown" for "not sent".
+        """
+        base = self.base_url.rstrip('/')
+        parameters = "actions[parameters[name,value]]"
+
+        def triggered_with(item: dict) -> bool:
+            return any(
+                parameter.get("name") == param and parameter.get("value") == value
+                for action in item.get("actions") or [] if action
+                for parameter in action.get("parameters") or []
+            )
+
+        response = await self._request(
+            "GET", f"{base}/queue/api/json", params={"tree": f"items[id,task[url],{parameters}]"}
+        )
+        response.raise_for_status()
+        job_url = f"/job/{self.job_path(job_name)}/"
+        for item in response.json().get("items", []):
+            if ((item.get("task") or {}).get("url") or "").endswith(job_url) and triggered_with(item):
+                return f"{base}/queue/item/{item['id']}/"
+
+        tree = f"builds[number,queueId,{parameters}]{{0,{settings.JENKINS_BUILDS_WINDOW}}}"
+        response = await self._request("GET", f"{base}/job/{self.job_path(job_name)}/api/json", params={"tree": tree})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        for build in response.json().get("builds", []):
+            if triggered_with(build):
+                return f"{base}/queue/item/{build['queueId']}/"
+        return None
+
     async def get_queue_item_info(self, queue_url: str):
         """Fetch queue item details to find the build number."""
-        async with httpx.AsyncClient() as client:
-            try:
-                # Append api/json to the queue URL (which usually ends with /)
-                url = f"{queue_url.rstrip('/')}/api/json"
-                response = await client.get(url, auth=self.auth, timeout=10.0)
-                if response.status_code == 404:
-                     # Item might have left the queue long ago or invalid URL
-                    return None
-                response.raise_for_status()
-                return response.json()
-            except Exception as e:
-                print(f"Error fetching queue item: {e}")
+        try:
+            # Append api/json to the queue URL (which usually ends with /)
+            url = f"{queue_url.rstrip('/')}/api/json"
+            response = await self._request("GET", url)
+            if response.status_code == 404:
+                # Item might have left the queue long ago or invalid URL
                 return None
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            print(f"Error fetching queue item: {e}")
+            return None
 
 jenkins_service = JenkinsService()
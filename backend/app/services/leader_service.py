@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.db.session import async_session
+from app.models.models import LeaderLease
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElector:
+    """
+    Elects one instance as leader through a lease row in the database.
+
+    Every instance tries to take or renew the lease each LEADER_HEARTBEAT seconds; the
+    lease is valid for LEADER_LEASE_TTL seconds, so a dead leader is replaced once it
+    expires, and a leader shutting down releases it for an immediate takeover. A leader
+    that cannot renew steps down before its lease runs out. Instance clocks are assumed
+    to be in sync (NTP).
+    """
+
+    def __init__(self, name: str = "leader"):
+        self.name = name
+        self.instance_id = settings.INSTANCE_ID or f"{socket.gethostname()}-{os.getpid()}"
+        self.is_leader = False
+        self._lease_until: Optional[datetime] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._on_elected: Optional[Callable[[], Awaitable[None]]] = None
+        self._on_demoted: Optional[Callable[[], Awaitable[None]]] = None
+        self.metrics = {"elections": 0, "demotions": 0, "heartbeat_errors": 0}
+
+    async def start(self, on_elected: Callable[[], Awaitable[None]], on_demoted: Callable[[], Awaitable[None]]):
+        if self._loop_task is not None:
+            return
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        if self.is_leader:
+            await self._demote()
+            await self._release()
+
+    def get_metrics(self) -> dict:
+        return {
+            **self.metrics,
+            "instance_id": self.instance_id,
+            "is_leader": self.is_leader,
+            "lease_until": self._lease_until if self.is_leader else None,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                acquired = await self._try_acquire()
+            except Exception as e:
+                self.metrics["heartbeat_errors"] += 1
+                logger.error(f"Leader lease heartbeat failed: {e}")
+                # Keep leading only while the last renewed lease is certainly still ours
+                acquired = self.is_leader and datetime.now() + timedelta(seconds=settings.LEADER_HEARTBEAT) < self._lease_until
+
+            if acquired and not self.is_leader:
+                await self._elect()
+            elif not acquired and self.is_leader:
+                await self._demote()
+            await asyncio.sleep(settings.LEADER_HEARTBEAT)
+
+    async def _try_acquire(self) -> bool:
+        """Take the lease if it is free or expired, or renew it if we hold it."""
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=settings.LEADER_LEASE_TTL)
+        table = LeaderLease.__table__
+        async with async_session() as session:
+            values = {"holder": self.instance_id, "expires_at": expires_at}
+            if not self.is_leader:
+                values["acquired_at"] = now
+            result = await session.execute(
+                update(table)
+                .where(table.c.name == self.name, or_(table.c.holder == self.instance_id, table.c.expires_at < now))
+                .values(**values)
+            )
+            if result.rowcount == 0:
+                # Either held by another live instance or the row does not exist yet
+                session.add(LeaderLease(name=self.name, holder=self.instance_id, acquired_at=now, expires_at=expires_at))
+                try:
+                    await session.commit()
+                except IntegrityError:
+                    await session.rollback()
+                    return False
+            else:
+                await session.commit()
+        self._lease_until = expires_at
+        return True
+
+    async def _release(self):
+        table = LeaderLease.__table__
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    update(table)
+                    .where(table.c.name == self.name, table.c.holder == self.instance_id)
+                    .values(expires_at=datetime.now())
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Failed to release leader lease: {e}")
+
+    async def _elect(self):
+        logger.info(f"Instance {self.instance_id} became leader")
+        self.is_leader = True
+        self.metrics["elections"] += 1
+        try:
+            await self._on_elected()
+        except Exception as e:
+            logger.error(f"Error starting leader services: {e}")
+
+    async def _demote(self):
+        logger.warning(f"Instance {self.instance_id} is no longer leader")
+        self.is_leader = False
+        self.metrics["demotions"] += 1
+        try:
+            await self._on_demoted()
+        except Exception as e:
+            logger.error(f"Error stopping leader services: {e}")
+
+leader_elector = LeaderElector()
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+
+from app.core.config import settings
+from app.db.session import async_session
+from app.models.models import NotificationConfig, NotificationDeadLetter, NotificationType
+from app.services.notification_service import notification_service
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class NotificationJob:
+    config: NotificationConfig
+    title: str
+    content: str
+    execution_id: Optional[int] = None
+    # Finished executions of a digest; sent as one summary message instead of title/content
+    items: Optional[List[dict]] = None
+    attempt: int = 0
+    last_error: Optional[str] = None
+    # The config's rate-limit token was taken when the job was released from the deferred list
+    has_token: bool = False
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available; returns 0, or the seconds until the next token."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class NotificationDispatcher:
+    """
+    Delivers notifications off the caller's path.
+
+    Finished executions are first buffered per config for NOTIFY_DIGEST_WINDOW seconds
+    and flushed as a single digest. Jobs then go through a bounded queue to a worker
+    pool, limited per channel type (concurrency) and per config (rate). A job whose
+    config is out of rate tokens does not hold a worker: it is parked in a per-config
+    list that one timer releases as tokens refill. Failed sends are retried with
+    exponential backoff, and the ones that never get through are persisted as dead letters.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._channel_limits: Dict[NotificationType, asyncio.Semaphore] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self.metrics = {"sent": 0, "failed_attempts": 0, "retried": 0, "dead_lettered": 0}
+        # config id -> {"config", "items", "timer"} of the open digest window
+        self._pending: Dict[int, dict] = {}
+        # config id -> jobs waiting for a rate-limit token, and the timer releasing them
+        self._deferred: Dict[int, Deque[NotificationJob]] = {}
+        self._deferred_timers: Dict[int, asyncio.TimerHandle] = {}
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=settings.NOTIFY_QUEUE_SIZE)
+        self._channel_limits = {
+            channel: asyncio.Semaphore(settings.NOTIFY_CHANNEL_CONCURRENCY) for channel in NotificationType
+        }
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(settings.NOTIFY_WORKERS)]
+
+    async def stop(self):
+        for config_id in list(self._pending):
+            self._flush(config_id)
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._drain(), timeout=settings.NOTIFY_SHUTDOWN_GRACE)
+            except asyncio.TimeoutError:
+                logger.warning("Notification queue not drained before shutdown")
+        for timer in self._deferred_timers.values():
+            timer.cancel()
+        self._deferred_timers = {}
+        self._deferred = {}
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def get_metrics(self) -> dict:
+        return {
+            **self.metrics,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "buffered_for_digest": sum(len(p["items"]) for p in self._pending.values()),
+            "deferred_by_rate_limit": sum(len(jobs) for jobs in self._deferred.values()),
+            "latency": notification_service.get_latency(),
+        }
+
+    def enqueue(self, config: NotificationConfig, title: str, content: str, execution_id: Optional[int] = None):
+        if not config.is_active:
+            return
+        self._put(NotificationJob(config, title, content, execution_id))
+
+    def enqueue_finished(self, config: NotificationConfig, item: dict):
+        """Report a finished execution, coalesced with others sent to the same config."""
+        if not config.is_active:
+            return
+        if settings.NOTIFY_DIGEST_WINDOW <= 0 or config.id is None:
+            title, content = notification_service.format_finished(item)
+            self.enqueue(config, title, content, execution_id=item.get("execution_id"))
+            return
+
+        pending = self._pending.get(config.id)
+        if pending is None:
+            timer = asyncio.get_running_loop().call_later(settings.NOTIFY_DIGEST_WINDOW, self._flush, config.id)
+            pending = self._pending[config.id] = {"config": config, "items": [], "timer": timer}
+        pending["items"].append(item)
+        if len(pending["items"]) >= settings.NOTIFY_DIGEST_MAX_ITEMS:
+            self._flush(config.id)
+
+    def _flush(self, config_id: int):
+        pending = self._pending.pop(config_id, None)
+        if pending is None:
+            return
+        pending["timer"].cancel()
+        items = pending["items"]
+        if len(items) == 1:
+            title, content = notification_service.format_finished(items[0])
+            self._put(NotificationJob(pending["config"], title, content, items[0].get("execution_id")))
+        else:
+            title = f"Task Digest ({len(items)})"
+            content = "\n".join(notification_service.format_finished(item)[0] for item in items)
+            self._put(NotificationJob(pending["config"], title, content, items=items))
+
+    def _put(self, job: NotificationJob):
+        if self._queue is None:
+            logger.warning("Notification dispatcher not started, dropping message")
+            return
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            job.last_error = "dispatch queue full"
+            asyncio.create_task(self._dead_letter(job))
+
+    def _bucket(self, config: NotificationConfig) -> TokenBucket:
+        key = config.id or 0
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(settings.NOTIFY_RATE_PER_SECOND, settings.NOTIFY_RATE_BURST)
+        return self._buckets[key]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._deliver(job)
+            except Exception as e:
+                logger.error(f"Error in notification worker: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _drain(self):
+        while True:
+            await self._queue.join()
+            if not self._deferred:
+                return
+            await asyncio.sleep(0.1)
+
+    def _take_token(self, job: NotificationJob) -> bool:
+        """Take the config's rate-limit token, or park the job (FIFO per config) and return False."""
+        key = job.config.id or 0
+        if key not in self._deferred:
+            wait = self._bucket(job.config).try_acquire()
+            if not wait:
+                return True
+            self._deferred[key] = deque()
+            self._deferred_timers[key] = asyncio.get_running_loop().call_later(wait, self._release, key)
+        self._deferred[key].append(job)
+        return False
+
+    def _release(self, key: int):
+        """Requeue parked jobs of a config as tokens become available."""
+        self._deferred_timers.pop(key, None)
+        jobs = self._deferred.get(key)
+        while jobs:
+            wait = self._bucket(jobs[0].config).try_acquire()
+            if wait:
+                self._deferred_timers[key] = asyncio.get_running_loop().call_later(wait, self._release, key)
+                return
+            job = jobs.popleft()
+            job.has_token = True
+            self._put(job)
+        self._deferred.pop(key, None)
+
+    async def _deliver(self, job: NotificationJob):
+        if not job.has_token and not self._take_token(job):
+            return
+        # A retry needs a token of its own
+        job.has_token = False
+        async with self._channel_limits[job.config.type]:
+            try:
+                if job.items:
+                    ok = await notification_service.send_digest(job.config, job.items)
+                else:
+                    ok = await notification_service.send_message(job.config, job.title, job.content)
+                error = None if ok else "delivery failed"
+            except Exception as e:
+                ok, error = False, str(e)
+
+        if ok:
+            self.metrics["sent"] += 1
+            return
+
+        self.metrics["failed_attempts"] += 1
+        job.attempt += 1
+        job.last_error = error
+        if job.attempt >= settings.NOTIFY_MAX_RETRIES:
+            await self._dead_letter(job)
+            return
+        self.metrics["retried"] += 1
+        delay = settings.NOTIFY_RETRY_DELAY * (2 ** (job.attempt - 1))
+        asyncio.get_running_loop().call_later(delay, self._put, job)
+
+    async def _dead_letter(self, job: NotificationJob):
+        self.metrics["dead_lettered"] += 1
+        logger.warning(f"Notification to config {job.config.id} dead-lettered: {job.last_error}")
+        try:
+            async with async_session() as session:
+                session.add(NotificationDeadLetter(
+                    config_id=job.config.id,
+                    execution_id=job.execution_id,
+                    title=job.title,
+                    content=job.content,
+                    attempts=job.attempt,
+                    last_error=job.last_error,
+                ))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Failed to persist dead letter: {e}")
+
+notification_dispatcher = NotificationDispatcher()
@@ -1,28 +1,161 @@
+import asyncio
 import httpx
 import json
+import logging
+import smtplib
 import time
 import hmac
 import hashlib
 import base64
+import urllib.parse
+from collections import defaultdict
+from email.message import EmailMessage
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
 from app.models.models import NotificationConfig, NotificationType
 
+logger = logging.getLogger(__name__)
+
+
+class SmtpConnection:
+    """A persistent, authenticated SMTP session shared by every message sent with one smtp_config."""
+
+    def __init__(self, smtp_config: dict):
+        self.host = smtp_config["host"]
+        self.use_ssl = smtp_config.get("use_ssl", smtp_config.get("port") == 465)
+        self.port = smtp_config.get("port") or (465 if self.use_ssl else 25)
+        self.use_tls = smtp_config.get("use_tls", not self.use_ssl and self.port == 587)
+        self.username = smtp_config.get("username")
+        self.password = smtp_config.get("password")
+        self.lock = asyncio.Lock()
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def send(self, message: EmailMessage):
+        """Blocking; run it in a worker thread while holding `lock`."""
+        if self._smtp is not None and time.monotonic() - self._last_used > settings.SMTP_IDLE_TIMEOUT:
+            # Servers drop idle sessions; reconnecting is cheaper than a failed send
+            self.close()
+        try:
+            self._connection().send_message(message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.close()
+            self._connection().send_message(message)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is None:
+            if self.use_ssl:
+                smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=settings.SMTP_TIMEOUT)
+            else:
+                smtp = smtplib.SMTP(self.host, self.port, timeout=settings.SMTP_TIMEOUT)
+                if self.use_tls:
+                    smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            self._smtp = smtp
+        return self._smtp
+
+
 class NotificationService:
+    """
+    Sends messages to Feishu, DingTalk and email channels.
+
+    Webhooks share one long-lived HTTP client and each smtp_config keeps one
+    authenticated SMTP session, so consecutive messages skip the TCP/TLS/login
+    handshake. Every send is timed per channel.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._smtp: Dict[tuple, SmtpConnection] = {}
+        self._latency = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=settings.NOTIFY_HTTP_TIMEOUT,
+                limits=httpx.Limits(keepalive_expiry=settings.NOTIFY_KEEPALIVE_EXPIRY),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        for connection in self._smtp.values():
+            async with connection.lock:
+                await asyncio.to_thread(connection.close)
+        self._smtp = {}
+
+    def get_latency(self) -> dict:
+        return {
+            channel.value: {
+                "count": stats["count"],
+                "avg_ms": round(stats["total_ms"] / stats["count"], 1),
+                "max_ms": round(stats["max_ms"], 1),
+            }
+            for channel, stats in self._latency.items() if stats["count"]
+        }
+
     async def send_test_message(self, config: NotificationConfig) -> bool:
         message = f"This is a test message from TestFlow Pro. Config: {config.name}"
         return await self.send_message(config, "Test Message", message)
 
+    def format_finished(self, item: dict) -> Tuple[str, str]:
+        """Title and body of the message for one finished execution."""
+        title = f"Task Finished: {item['template_name']} (#{item['build_number']})"
+        content = f"Status: {item['status']}\nDuration: {item['duration']}ms\nReport: {item['report_url']}"
+        return title, content
+
+    async def send_digest(self, config: NotificationConfig, items: List[dict]) -> bool:
+        """One message summarising several finished executions."""
+        if not config.is_active:
+            return False
+
+        passed = sum(1 for item in items if item["status"] == "SUCCESS")
+        title = f"Task Digest: {len(items)} finished, {passed} passed, {len(items) - passed} not passed"
+        if config.type == NotificationType.FEISHU:
+            return await self._send_feishu_digest(config, title, items, passed)
+
+        lines = [
+            f"[{item['status']}] {item['template_name']} #{item['build_number']} - {item['report_url']}"
+            for item in items
+        ]
+        return await self.send_message(config, title, "\n".join(lines))
+
     async def send_message(self, config: NotificationConfig, title: str, content: str) -> bool:
         if not config.is_active:
             return False
 
         if config.type == NotificationType.FEISHU:
-            return await self._send_feishu(config, title, content)
+            return await self._timed(config, self._send_feishu(config, title, content))
         elif config.type == NotificationType.DINGTALK:
-            return await self._send_dingtalk(config, title, content)
+            return await self._timed(config, self._send_dingtalk(config, title, content))
         elif config.type == NotificationType.EMAIL:
-            return await self._send_email(config, title, content)
+            return await self._timed(config, self._send_email(config, title, content))
         return False
 
+    async def _timed(self, config: NotificationConfig, send) -> bool:
+        started = time.monotonic()
+        ok = await send
+        elapsed_ms = (time.monotonic() - started) * 1000
+        stats = self._latency[config.type]
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        logger.info(f"{config.type.value} send to config {config.id} took {elapsed_ms:.1f}ms (ok={ok})")
+        return ok
+
     async def _send_feishu(self, config: NotificationConfig, title: str, content: str) -> bool:
         """
         Send Feishu interactive card or simple text.
@@ -37,7 +170,36 @@ class NotificationService:
                 "text": f"{title}{content}"
             }
         }
-        
+        return await self._post_feishu(config, payload)
+
+    async def _send_feishu_digest(self, config: NotificationConfig, title: str, items: List[dict], passed: int) -> bool:
+        if not config.webhook_url:
+            return False
+
+        lines = []
+        for item in items:
+            mark = "✅" if item["status"] == "SUCCESS" else "❌"
+            lines.append(
+                f"{mark} **{item['template_name']}** #{item['build_number']} "
+                f"({item['env'] or '-'}) {item['status']} [Report]({item['report_url']})"
+            )
+        payload = {
+            "msg_type": "interactive",
+            "card": {
+                "header": {
+                    "title": {"tag": "plain_text", "content": title},
+                    "template": "green" if passed == len(items) else "red",
+                },
+                "elements": [
+                    {"tag": "div", "text": {"tag": "lark_md", "content": f"**Passed** {passed} / **Not passed** {len(items) - passed}"}},
+                    {"tag": "hr"},
+                    {"tag": "div", "text": {"tag": "lark_md", "content": "\n".join(lines)}},
+                ],
+            },
+        }
+        return await self._timed(config, self._post_feishu(config, payload))
+
+    async def _post_feishu(self, config: NotificationConfig, payload: dict) -> bool:
         # Handle signature if secret is present
         if config.secret:
             timestamp = str(round(time.time()))
@@ -48,24 +210,76 @@ class NotificationService:
             payload["timestamp"] = timestamp
             payload["sign"] = sign
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(config.webhook_url, json=payload, timeout=10.0)
-                response.raise_for_status()
-                res_json = response.json()
-                return res_json.get("code") == 0
-            except Exception as e:
-                print(f"Error sending Feishu message: {e}")
-                return False
+        try:
+            response = await self._get_client().post(config.webhook_url, json=payload)
+            response.raise_for_status()
+            res_json = response.json()
+            return res_json.get("code") == 0
+        except Exception as e:
+            logger.error(f"Error sending Feishu message: {e}")
+            return False
 
     async def _send_dingtalk(self, config: NotificationConfig, title: str, content: str) -> bool:
-        # Placeholder for DingTalk
-        print(f"Mock DingTalk send to {config.webhook_url}: {title} - {content}")
-        return True
+        if not config.webhook_url:
+            return False
+
+        url = config.webhook_url
+        if config.secret:
+            # DingTalk signs "<timestamp ms>\n<secret>" with the secret as HMAC key
+            timestamp = str(round(time.time() * 1000))
+            string_to_sign = f"{timestamp}\n{config.secret}"
+            hmac_code = hmac.new(config.secret.encode("utf-8"), string_to_sign.encode("utf-8"), digestmod=hashlib.sha256).digest()
+            sign = urllib.parse.quote_plus(base64.b64encode(hmac_code))
+            url = f"{url}{'&' if '?' in url else '?'}timestamp={timestamp}&sign={sign}"
+
+        payload = {
+            "msgtype": "markdown",
+            "markdown": {
+                "title": title,
+                "text": f"### {title}\n\n" + content.replace("\n", "\n\n"),
+            }
+        }
+        try:
+            response = await self._get_client().post(url, json=payload)
+            response.raise_for_status()
+            res_json = response.json()
+            if res_json.get("errcode") != 0:
+                logger.warning(f"DingTalk rejected message: {res_json.get('errmsg')}")
+                return False
+            return True
+        except Exception as e:
+            logger.error(f"Error sending DingTalk message: {e}")
+            return False
 
     async def _send_email(self, config: NotificationConfig, title: str, content: str) -> bool:
-        # Placeholder for Email
-        print(f"Mock Email send: {title}")
-        return True
+        smtp_config = config.smtp_config or {}
+        recipients = smtp_config.get("recipients") or []
+        if isinstance(recipients, str):
+            recipients = [r.strip() for r in recipients.split(",") if r.strip()]
+        if not smtp_config.get("host") or not recipients:
+            return False
+
+        message = EmailMessage()
+        message["Subject"] = title
+        message["From"] = smtp_config.get("sender") or smtp_config.get("username")
+        message["To"] = ", ".join(recipients)
+        message.set_content(content)
+
+        connection = self._smtp_connection(smtp_config)
+        try:
+            async with connection.lock:
+                await asyncio.to_thread(connection.send, message)
+            return True
+        except Exception as e:
+            logger.error(f"Error sending email: {e}")
+            async with connection.lock:
+                await asyncio.to_thread(connection.close)
+            return False
+
+    def _smtp_connection(self, smtp_config: dict) -> SmtpConnection:
+        key = (smtp_config["host"], smtp_config.get("port"), smtp_config.get("username"), smtp_config.get("password"))
+        if key not in self._smtp:
+            self._smtp[key] = SmtpConnection(smtp_config)
+        return self._smtp[key]
 
 notification_service = NotificationService()
@@ -1,19 +1,91 @@
 import asyncio
+import heapq
 import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 from datetime import datetime
 
+from app.core.config import settings
 from app.db.session import async_session
-from app.models.models import TaskExecution, TaskStatus, TestTemplate, NotificationConfig
+from app.models.models import TaskExecution, TaskStatus
+from app.services.cache_service import catalog_cache
 from app.services.jenkins_service import jenkins_service
-from app.services.notification_service import notification_service
+from app.services.shard_service import shard_coordinator
+from app.services.transition_service import FINISHED_STATUSES, Transition, transition_service
+from app.services.trigger_dispatcher import trigger_dispatcher
 
 logger = logging.getLogger(__name__)
 
+class PollSchedule:
+    """Next-check deadlines of in-flight executions, kept in a min-heap."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int]] = []
+        # task id -> {"deadline": float, "status": TaskStatus}
+        self._entries: Dict[int, dict] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sync(self, tasks: List[TaskExecution], now: float):
+        """Track new tasks (due immediately) and forget those no longer in flight."""
+        seen = set()
+        for task in tasks:
+            seen.add(task.id)
+            entry = self._entries.get(task.id)
+            if entry is None or entry["status"] != task.status:
+                # New, or moved on outside this poller: check right away
+                self.schedule(task.id, task.status, now)
+        for task_id in list(self._entries):
+            if task_id not in seen:
+                del self._entries[task_id]
+
+    def schedule(self, task_id: int, status: TaskStatus, deadline: float):
+        self._entries[task_id] = {"deadline": deadline, "status": status}
+        heapq.heappush(self._heap, (deadline, task_id))
+
+    def forget(self, task_id: int):
+        self._entries.pop(task_id, None)
+
+    def defer(self, task_id: int, status: TaskStatus, until: float):
+        """Push a task's next check out to at least `until`."""
+        entry = self._entries.get(task_id)
+        if entry is None or entry["deadline"] < until:
+            self.schedule(task_id, status, until)
+
+    def overdue(self, task_id: int, now: float) -> float:
+        """Seconds a task's check is past its deadline (0 if not due)."""
+        entry = self._entries.get(task_id)
+        return max(now - entry["deadline"], 0.0) if entry else 0.0
+
+    def is_due(self, task_id: int, now: float) -> bool:
+        entry = self._entries.get(task_id)
+        return entry is not None and entry["deadline"] <= now
+
+    def next_deadline(self) -> Optional[float]:
+        # Drop heap entries that were superseded by a later schedule() or forget()
+        while self._heap:
+            deadline, task_id = self._heap[0]
+            entry = self._entries.get(task_id)
+            if entry is not None and entry["deadline"] == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+
 class StatusPoller:
     def __init__(self):
         self.running = False
+        self.last_cycle: dict = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._timeouts = 0
+        self._schedule = PollSchedule()
+        # template id -> (fetched at, average successful build duration in ms)
+        self._expected_durations: Dict[int, Tuple[float, Optional[float]]] = {}
 
     async def start(self):
         self.running = True
@@ -23,155 +95,328 @@ class StatusPoller:
                 await self.poll()
             except Exception as e:
                 logger.error(f"Error in poller loop: {e}")
-            await asyncio.sleep(10)
+            await asyncio.sleep(self._sleep_interval())
 
     async def stop(self):
         self.running = False
 
-    async def poll(self):
-        async with async_session() as session:
-            # 1. Handle QUEUED tasks
-            await self._process_queued_tasks(session)
-            
-            # 2. Handle RUNNING tasks
-            await self._process_running_tasks(session)
+    def get_metrics(self) -> dict:
+        return self.last_cycle
+
+    def _sleep_interval(self) -> float:
+        """Sleep until the earliest task deadline, but at most one tick so new tasks are noticed."""
+        next_deadline = self._schedule.next_deadline()
+        if next_deadline is None:
+            return settings.POLLER_TICK
+        return min(max(next_deadline - time.time(), 0.2), settings.POLLER_TICK)
 
-    async def _process_queued_tasks(self, session: AsyncSession):
+    def _next_delay(self, task: TaskExecution, build_info: Optional[dict], now: float) -> float:
+        """
+        Seconds until a task's next check.
+
+        The interval grows with the task's age (exponential backoff), and for running
+        builds it is cut so that one check lands on the job's historical finish time.
+        """
+        factor = settings.POLLER_BACKOFF_FACTOR - 1
+        started = task.start_time.timestamp()
+        if build_info and build_info.get("timestamp"):
+            started = build_info["timestamp"] / 1000
+        elapsed = max(now - started, 0)
+        delay = elapsed * factor
+
+        if task.status == TaskStatus.RUNNING:
+            expected = self._expected_durations.get(task.template_id, (0, None))[1]
+            if expected:
+                remaining = expected / 1000 - elapsed
+                if remaining > 0:
+                    delay = min(delay, remaining)
+                else:
+                    # Overrunning: back off again, counting from the expected finish
+                    delay = -remaining * factor
+
+        return min(max(delay, settings.POLLER_MIN_INTERVAL), settings.POLLER_MAX_INTERVAL)
+
+    async def _refresh_expected_durations(self, session: AsyncSession, template_ids: set):
+        now = time.time()
+        stale = [
+            template_id for template_id in template_ids
+            if now - self._expected_durations.get(template_id, (0, None))[0] > settings.POLLER_HISTORY_TTL
+        ]
+        if not stale:
+            return
         result = await session.execute(
-            select(TaskExecution).where(TaskExecution.status == TaskStatus.QUEUED)
+            select(TaskExecution.template_id, func.avg(TaskExecution.duration))
+            .where(
+                TaskExecution.template_id.in_(stale),
+                TaskExecution.status == TaskStatus.SUCCESS,
+                TaskExecution.duration > 0,
+            )
+            .group_by(TaskExecution.template_id)
         )
+        averages = {template_id: avg for template_id, avg in result.all()}
+        for template_id in stale:
+            avg = averages.get(template_id)
+            self._expected_durations[template_id] = (now, float(avg) if avg else None)
+
+    async def _call(self, coro):
+        """Run one Jenkins call under the fan-out limit and the per-call time budget."""
+        async with self._semaphore:
+            try:
+                return await asyncio.wait_for(coro, timeout=settings.POLLER_CALL_TIMEOUT)
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                logger.warning("Jenkins call timed out in poller")
+                return None
+
+    async def poll(self):
+        owned = set(shard_coordinator.owned)
+        if not owned:
+            # Every shard is polled by another worker
+            self._schedule.sync([], time.time())
+            return
+        self._semaphore = asyncio.Semaphore(settings.POLLER_CONCURRENCY)
+        self._timeouts = 0
+        cycle_start = time.monotonic()
+        phases = {}
+
+        async with async_session() as session:
+            # 1. Load in-flight tasks
+            phase_start = time.monotonic()
+            now = time.time()
+            queued, running = await self._load_tasks(session, owned)
+            self._schedule.sync([task for task, _ in queued + running], now)
+            await self._refresh_expected_durations(session, {template.id for _, template in running})
+            shard_stats = {shard_id: {"tracked_tasks": 0, "lag_ms": 0.0} for shard_id in owned}
+            for task, _ in queued + running:
+                shard_stats[shard_coordinator.shard_of(task.template_id)]["tracked_tasks"] += 1
+
+            # Only tasks whose next-check deadline has passed are sent to Jenkins
+            queued = [(task, template) for task, template in queued if self._is_due(task, now)]
+            running = [(task, template) for task, template in running if self._is_due(task, now)]
+            for task, _ in queued + running:
+                stats = shard_stats[shard_coordinator.shard_of(task.template_id)]
+                stats["lag_ms"] = max(stats["lag_ms"], round(self._schedule.overdue(task.id, now) * 1000, 1))
+            shard_coordinator.report(shard_stats)
+            phases["load_ms"] = round((time.monotonic() - phase_start) * 1000, 1)
+
+            # 2. Query Jenkins for QUEUED and RUNNING tasks concurrently, sharing each job's builds
+            phase_start = time.monotonic()
+            job_builds: Dict[str, asyncio.Future] = {}
+            queued_updates, build_infos = await asyncio.gather(
+                self._fetch_queued_updates(queued, job_builds),
+                self._fetch_running_builds(running, job_builds),
+            )
+            phases["fetch_ms"] = round((time.monotonic() - phase_start) * 1000, 1)
+
+            # 3. Persist every transition of the cycle in one transaction
+            phase_start = time.monotonic()
+            transitions = self._queued_transitions(queued, queued_updates)
+            transitions += self._running_transitions(running, build_infos)
+            applied = await transition_service.apply(session, transitions)
+            phases["apply_ms"] = round((time.monotonic() - phase_start) * 1000, 1)
+
+            # 4. Notify only once the batch is committed
+            phase_start = time.monotonic()
+            await transition_service.on_applied(session, applied)
+            if any(t.task.status in FINISHED_STATUSES for t in applied):
+                # Finished builds free capacity for executions held back by the build caps
+                trigger_dispatcher.notify()
+            phases["notify_ms"] = round((time.monotonic() - phase_start) * 1000, 1)
+
+            # 5. Work out when each checked task is due next
+            self._reschedule(queued + running, applied, build_infos)
+
+        self.last_cycle = {
+            "finished_at": datetime.now(),
+            "duration_ms": round((time.monotonic() - cycle_start) * 1000, 1),
+            "phases": phases,
+            "tracked_tasks": len(self._schedule),
+            "checked_queued_tasks": len(queued),
+            "checked_running_tasks": len(running),
+            "transitions": len(applied),
+            "conflicts": len(transitions) - len(applied),
+            "timeouts": self._timeouts,
+            "shards": shard_stats,
+        }
+
+    def _is_due(self, task: TaskExecution, now: float) -> bool:
+        if task.last_event_at:
+            quiet_until = task.last_event_at.timestamp() + settings.WEBHOOK_QUIET_PERIOD
+            if quiet_until > now:
+                # Jenkins pushes this build's events, no need to ask until it has been quiet a while
+                self._schedule.defer(task.id, task.status, quiet_until)
+                return False
+        return self._schedule.is_due(task.id, now)
+
+    def _reschedule(self, checked, applied: List[Transition], build_infos: dict):
+        now = time.time()
+        transitioned = {t.task.id for t in applied if "status" in t.values}
+        for task, _ in checked:
+            if task.status not in (TaskStatus.QUEUED, TaskStatus.RUNNING):
+                self._schedule.forget(task.id)
+            elif task.id in transitioned:
+                # Just started building: look again soon
+                self._schedule.schedule(task.id, task.status, now + settings.POLLER_MIN_INTERVAL)
+            else:
+                delay = self._next_delay(task, build_infos.get(task.id), now)
+                self._schedule.schedule(task.id, task.status, now + delay)
+
+    async def _load_tasks(self, session: AsyncSession, shards: set):
+        """Return (task, template) pairs for the QUEUED and the RUNNING executions of the given shards."""
+        statement = select(TaskExecution).where(TaskExecution.status.in_([TaskStatus.QUEUED, TaskStatus.RUNNING]))
+        if settings.POLLER_SHARDS > 1:
+            statement = statement.where((TaskExecution.template_id % settings.POLLER_SHARDS).in_(shards))
+        result = await session.execute(statement)
         tasks = result.scalars().all()
-        
+        templates = await catalog_cache.get_templates(session, [task.template_id for task in tasks])
+
+        queued, running = [], []
         for task in tasks:
-            template = await session.get(TestTemplate, task.template_id)
+            # Tasks are read-only snapshots here; changes are written by transition_service
+            session.expunge(task)
+            template = templates.get(task.template_id)
             if not template:
                 continue
-            
-            # If we have a queue URL, check it specifically
-            if task.jenkins_queue_item_url:
-                queue_info = await jenkins_service.get_queue_item_info(task.jenkins_queue_item_url)
-                
-                if queue_info:
-                    # Check if it has an executable (means it started building)
-                    if queue_info.get("executable"):
-                        task.build_number = queue_info["executable"].get("number")
-                        task.status = TaskStatus.RUNNING
-                        # We could fetch start time from the build info here or wait for running processor
-                        session.add(task)
-                        await session.commit()
-                    elif queue_info.get("cancelled"):
-                        task.status = TaskStatus.ABORTED
-                        session.add(task)
-                        await session.commit()
-                    # Else: still in queue, do nothing
-                else:
-                    # Queue item not found (404), maybe it finished queueing very quickly?
-                    # Fallback: Check recent builds to see if we can match the queue ID
-                    # Extract queue ID from URL: .../queue/item/123/ -> 123
-                    try:
-                        q_id = int(task.jenkins_queue_item_url.strip("/").split("/")[-1])
-                        # Get recent builds (e.g. last 5)
-                        job_info = await jenkins_service.get_jobs() # This is too broad, need specific job details
-                        # Actually we need get_build_info loop
-                        # Let's just check the last few builds
-                        # Optimization: Just check lastBuild for now as a quick fix if it matches
-                        last_build = await jenkins_service.get_build_info(template.jenkins_job_name, "lastBuild")
-                        if last_build and last_build.get("queueId") == q_id:
-                             task.build_number = last_build.get("number")
-                             task.status = TaskStatus.RUNNING
-                             session.add(task)
-                             await session.commit()
-                    except Exception as e:
-                        logger.error(f"Error handling missing queue item for task {task.id}: {e}")
+            if task.status == TaskStatus.QUEUED:
+                queued.append((task, template))
+            else:
+                running.append((task, template))
+        return queued, running
+
+    def _job_builds(self, job_builds: Dict[str, asyncio.Future], job_name: str) -> asyncio.Future:
+        """Recent builds of a job, requested at most once per cycle and shared by both phases."""
+        if job_name not in job_builds:
+            job_builds[job_name] = asyncio.ensure_future(self._call(jenkins_service.get_job_builds(job_name)))
+        return job_builds[job_name]
+
+    async def _fetch_queued_updates(self, queued, job_builds: Dict[str, asyncio.Future]) -> dict:
+        """
+        Work out the new state of the due QUEUED tasks, keyed by task id.
 
+        One snapshot of the Jenkins queue covers every task still waiting (with its queue
+        position and reason). Tasks that left the queue are matched by queue id against the
+        recent builds of their job, shared with the RUNNING phase. Only items found in
+        neither (cancelled, or started after the builds were fetched) are looked up one by one.
+        """
+        if not queued:
+            return {}
+        snapshot = await self._call(jenkins_service.get_queue())
+        if snapshot is None:
+            return {}
+        # Jenkins hands out executors to the longest-waiting buildable items first
+        ordered = sorted(snapshot, key=lambda item: (item.get("inQueueSince", 0), item.get("id", 0)))
+        waiting = {item.get("id"): (position, item) for position, item in enumerate(ordered, 1)}
+
+        updates = {}
+        left = []
+        for task, template in queued:
+            queue_id = self._queue_id(task)
+            if queue_id is not None and queue_id in waiting:
+                position, item = waiting[queue_id]
+                reason = (item.get("why") or "")[:255] or None
+                if (task.queue_position, task.queue_reason) != (position, reason):
+                    updates[task.id] = {"queue_position": position, "queue_reason": reason}
             else:
-                # Old behavior fallback (or if trigger failed to save URL)
-                # This is prone to the original race condition, but kept for legacy compat
-                last_build = await jenkins_service.get_build_info(template.jenkins_job_name, "lastBuild")
-                if last_build:
-                    # Basic check: if last build is running, assume it's ours? 
-                    # Dangerous, but better than stuck.
-                    # A better heuristic: is the start time AFTER our task creation?
-                    build_time = last_build.get("timestamp", 0) / 1000
-                    if build_time > task.start_time.timestamp():
-                        task.build_number = last_build.get("number")
-                        task.status = TaskStatus.RUNNING
-                        session.add(task)
-                        await session.commit()
-
-    async def _process_running_tasks(self, session: AsyncSession):
-        result = await session.execute(
-            select(TaskExecution).where(TaskExecution.status == TaskStatus.RUNNING)
-        )
-        tasks = result.scalars().all()
+                left.append((task, template, queue_id))
+        if not left:
+            return updates
 
-        for task in tasks:
-            if not task.build_number:
-                continue 
+        job_names = list({template.jenkins_job_name for _, template, _ in left})
+        builds = await asyncio.gather(*[self._job_builds(job_builds, job_name) for job_name in job_names])
+        builds_by_job = dict(zip(job_names, builds))
 
-            template = await session.get(TestTemplate, task.template_id)
-            if not template:
+        started = {"queue_position": None, "queue_reason": None}
+        claimed: Dict[str, set] = {}
+        unmatched = []
+        for task, template, queue_id in left:
+            job_name = template.jenkins_job_name
+            build = self._match_build(task, queue_id, builds_by_job.get(job_name) or [], claimed.get(job_name, set()))
+            if build:
+                claimed.setdefault(job_name, set()).add(build["number"])
+                updates[task.id] = {"status": TaskStatus.RUNNING, "build_number": build["number"], **started}
+            elif queue_id is not None:
+                unmatched.append(task)
+
+        queue_infos = await asyncio.gather(*[
+            self._call(jenkins_service.get_queue_item_info(task.jenkins_queue_item_url)) for task in unmatched
+        ])
+        for task, queue_info in zip(unmatched, queue_infos):
+            if not queue_info:
                 continue
+            if queue_info.get("executable"):
+                updates[task.id] = {"status": TaskStatus.RUNNING, "build_number": queue_info["executable"].get("number"), **started}
+            elif queue_info.get("cancelled"):
+                updates[task.id] = {"status": TaskStatus.ABORTED, **started}
+        return updates
 
-            build_info = await jenkins_service.get_build_info(template.jenkins_job_name, task.build_number)
-            if not build_info:
+    def _queue_id(self, task: TaskExecution) -> Optional[int]:
+        """Queue item id from the stored URL: .../queue/item/123/ -> 123"""
+        if not task.jenkins_queue_item_url:
+            return None
+        try:
+            return int(task.jenkins_queue_item_url.strip("/").split("/")[-1])
+        except ValueError:
+            return None
+
+    def _match_build(self, task: TaskExecution, queue_id: Optional[int], builds: list, claimed: set) -> Optional[dict]:
+        if queue_id is not None:
+            return next((build for build in builds if build.get("queueId") == queue_id), None)
+        # Legacy executions without a queue URL: the oldest unclaimed build started after the trigger
+        for build in reversed(builds):
+            if build.get("number") in claimed:
                 continue
+            if build.get("timestamp", 0) / 1000 > task.start_time.timestamp():
+                return build
+        return None
 
-            if build_info.get("building"):
-                continue 
-
-            result_str = build_info.get("result", "UNKNOWN")
-            
-            if result_str == "SUCCESS":
-                task.status = TaskStatus.SUCCESS
-            elif result_str == "FAILURE":
-                task.status = TaskStatus.FAILURE
-            elif result_str == "ABORTED":
-                task.status = TaskStatus.ABORTED
-            else:
-                task.status = TaskStatus.FAILURE 
-
-            task.duration = build_info.get("duration", 0)
-            
-            jenkins_url = jenkins_service.base_url
-            task.allure_report_url = f"{jenkins_url}/job/{template.jenkins_job_name}/{task.build_number}/allure/"
-            
-            task.stats = {
-                "statistic": {
-                    "failed": 0,
-                    "broken": 0,
-                    "skipped": 0,
-                    "passed": 2,
-                    "unknown": 0,
-                    "total": 2
-                    },
-                "time": {
-                    "start": 1770545521341,
-                    "stop": 1770545521343,
-                    "duration": 2,
-                    "minDuration": 0,
-                    "maxDuration": 0,
-                    "sumDuration": 0
-                    }
-                } 
-            
-            session.add(task)
-            await session.commit()
-            
-            await self._trigger_notification(session, task, template)
-
-    async def _trigger_notification(self, session: AsyncSession, task: TaskExecution, template: TestTemplate):
-        if not task.should_notify:
-            return
+    def _queued_transitions(self, queued, updates: dict):
+        transitions = []
+        for task, template in queued:
+            update = updates.get(task.id)
+            if update:
+                transitions.append(Transition(task, template, TaskStatus.QUEUED, update))
+        return transitions
 
-        if not template.notification_ids:
-            return
+    async def _fetch_running_builds(self, running, job_builds: Dict[str, asyncio.Future]) -> dict:
+        """Return build info keyed by task id for every RUNNING task Jenkins answered for."""
+        # Group by Jenkins job so N running builds of one job cost a single request
+        tasks_by_job = defaultdict(list)
+        for task, template in running:
+            if not task.build_number:
+                continue
+            tasks_by_job[template.jenkins_job_name].append(task)
 
-        for notif_id in template.notification_ids:
-            config = await session.get(NotificationConfig, notif_id)
-            if config:
-                title = f"Task Finished: {template.name} (#{task.build_number})"
-                content = f"Status: {task.status}\nDuration: {task.duration}ms\nReport: {task.allure_report_url}"
-                await notification_service.send_message(config, title, content)
+        job_names = list(tasks_by_job)
+        fetched = await asyncio.gather(*[self._job_builds(job_builds, job_name) for job_name in job_names])
+
+        build_infos = {}
+        missing = []
+        for job_name, builds in zip(job_names, fetched):
+            builds_by_number = {build.get("number"): build for build in builds or []}
+            for task in tasks_by_job[job_name]:
+                build_info = builds_by_number.get(task.build_number)
+                if build_info is None:
+                    # Build is older than the fetched window (or the batch call failed)
+                    missing.append((job_name, task))
+                else:
+                    build_infos[task.id] = build_info
+
+        fallback = await asyncio.gather(*[
+            self._call(jenkins_service.get_build_info(job_name, task.build_number)) for job_name, task in missing
+        ])
+        for (_, task), build_info in zip(missing, fallback):
+            if build_info:
+                build_infos[task.id] = build_info
+        return build_infos
+
+    def _running_transitions(self, running, build_infos: dict):
+        transitions = []
+        for task, template in running:
+            build_info = build_infos.get(task.id)
+            if not build_info or build_info.get("building"):
+                continue
+            values = transition_service.completion_values(template, task.build_number, build_info)
+            transitions.append(Transition(task, template, TaskStatus.RUNNING, values))
+        return transitions
 
 status_poller = StatusPoller()
@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import math
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.core.config import settings
+from app.db.session import async_session
+from app.models.models import ExecutionRollup, TaskExecution, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+# (template id, env, day)
+RollupKey = Tuple[int, str, date]
+
+ROLLUP_STATUSES = (TaskStatus.SUCCESS, TaskStatus.FAILURE, TaskStatus.ABORTED)
+
+
+def percentile(values: List[int], pct: float) -> Optional[int]:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[max(math.ceil(pct / 100 * len(values)), 1) - 1]
+
+
+class RollupService:
+    """
+    Per template x env x day rollups of finished executions for the analytics API.
+
+    A rollup row is recomputed from its day's executions whenever one of them finishes or
+    gets its Allure summary, so updates are idempotent and cost one day of one template,
+    never the whole history. The backfill rebuilds a date range day by day the same way.
+
+    Finishing executions only mark their rollup dirty (enqueue); a background task
+    recomputes the dirty rollups every ROLLUP_DELAY seconds, so a burst of completions
+    costs one query per day and one commit, off the poller and webhook path.
+    """
+
+    def __init__(self):
+        self._dirty: Set[RollupKey] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self.metrics = {"refreshes": 0, "rollups": 0, "errors": 0}
+
+    async def start(self):
+        if self._loop_task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        try:
+            await self._refresh_dirty()
+        except Exception as e:
+            logger.error(f"Failed to update execution rollups on shutdown: {e}")
+
+    def get_metrics(self) -> dict:
+        return {**self.metrics, "dirty": len(self._dirty)}
+
+    def key_of(self, execution: TaskExecution) -> RollupKey:
+        return execution.template_id, execution.execution_env or "", execution.start_time.date()
+
+    def enqueue(self, executions: Iterable[TaskExecution]):
+        """Mark the rollups of the given executions for recomputation; never blocks the caller."""
+        self._dirty.update(self.key_of(execution) for execution in executions)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let a burst of completions gather into one refresh
+            await asyncio.sleep(settings.ROLLUP_DELAY)
+            self._wakeup.clear()
+            try:
+                await self._refresh_dirty()
+            except Exception as e:
+                self.metrics["errors"] += 1
+                logger.error(f"Failed to update execution rollups: {e}")
+                self._wakeup.set()
+
+    async def _refresh_dirty(self):
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        try:
+            async with async_session() as session:
+                await self.refresh(session, keys)
+        except Exception:
+            # Retried on the next cycle
+            self._dirty |= keys
+            raise
+        self.metrics["refreshes"] += 1
+        self.metrics["rollups"] += len(keys)
+
+    async def refresh(self, session: AsyncSession, keys: Iterable[RollupKey]):
+        """Recompute the given rollups with one query per day and one commit."""
+        by_day: Dict[date, Set[RollupKey]] = defaultdict(set)
+        for key in keys:
+            by_day[key[2]].add(key)
+        for day, day_keys in by_day.items():
+            start, end = self._day_range(day)
+            result = await session.execute(
+                select(
+                    TaskExecution.template_id, TaskExecution.execution_env,
+                    TaskExecution.status, TaskExecution.duration, TaskExecution.stats,
+                ).where(
+                    TaskExecution.template_id.in_({template_id for template_id, _, _ in day_keys}),
+                    TaskExecution.start_time >= start,
+                    TaskExecution.start_time < end,
+                    TaskExecution.status.in_(ROLLUP_STATUSES),
+                )
+            )
+            groups: Dict[RollupKey, list] = {key: [] for key in day_keys}
+            for template_id, env, status, duration, stats in result.all():
+                key = (template_id, env or "", day)
+                if key in groups:
+                    groups[key].append((status, duration, stats))
+            for key, rows in groups.items():
+                await self._save(session, key, self._aggregate(rows))
+        await session.commit()
+
+    async def backfill(self, session: AsyncSession, start: date, end: date) -> dict:
+        """Rebuild the rollups of every day in [start, end] from the executions table."""
+        days = rollups = executions = 0
+        day = start
+        while day <= end:
+            day_start, day_end = self._day_range(day)
+            result = await session.execute(
+                select(
+                    TaskExecution.template_id, TaskExecution.execution_env,
+                    TaskExecution.status, TaskExecution.duration, TaskExecution.stats,
+                ).where(
+                    TaskExecution.start_time >= day_start,
+                    TaskExecution.start_time < day_end,
+                    TaskExecution.status.in_(ROLLUP_STATUSES),
+                )
+            )
+            groups: Dict[RollupKey, list] = defaultdict(list)
+            for template_id, env, status, duration, stats in result.all():
+                groups[(template_id, env or "", day)].append((status, duration, stats))
+                executions += 1
+            for key, rows in groups.items():
+                await self._save(session, key, self._aggregate(rows))
+            await session.commit()
+
+            # Drop rollups whose executions are gone (e.g. deleted templates)
+            existing = await session.execute(
+                select(ExecutionRollup.id, ExecutionRollup.template_id, ExecutionRollup.env)
+                .where(ExecutionRollup.day == day)
+            )
+            stale = [row.id for row in existing if (row.template_id, row.env, day) not in groups]
+            if stale:
+                await session.execute(delete(ExecutionRollup).where(ExecutionRollup.id.in_(stale)))
+                await session.commit()
+
+            days += 1
+            rollups += len(groups)
+            day += timedelta(days=1)
+        return {"days": days, "rollups": rollups, "executions": executions}
+
+    async def get_trends(
+        self,
+        session: AsyncSession,
+        start: date,
+        end: date,
+        template_id: Optional[int] = None,
+        env: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        One point per day in [start, end], merged over the matching rollups.
+
+        Percentiles of several rollups are combined as a runs-weighted mean, which is an
+        approximation; filter by template and env for exact values.
+        """
+        statement = select(ExecutionRollup).where(ExecutionRollup.day >= start, ExecutionRollup.day <= end)
+        if template_id is not None:
+            statement = statement.where(ExecutionRollup.template_id == template_id)
+        if env is not None:
+            statement = statement.where(ExecutionRollup.env == env)
+        result = await session.execute(statement)
+        by_day: Dict[date, List[ExecutionRollup]] = defaultdict(list)
+        for rollup in result.scalars().all():
+            by_day[rollup.day].append(rollup)
+
+        points = []
+        day = start
+        while day <= end:
+            points.append(self._merge(day, by_day.get(day, [])))
+            day += timedelta(days=1)
+        return points
+
+    def _merge(self, day: date, rollups: List[ExecutionRollup]) -> dict:
+        point = {"day": day}
+        for column in ("runs", "success", "failure", "aborted", "tests_total", "tests_passed", "tests_failed", "tests_skipped"):
+            point[column] = sum(getattr(rollup, column) for rollup in rollups)
+        for column in ("duration_p50", "duration_p95"):
+            weighted = [(getattr(rollup, column), rollup.runs) for rollup in rollups if getattr(rollup, column) is not None]
+            weight = sum(runs for _, runs in weighted)
+            point[column] = round(sum(value * runs for value, runs in weighted) / weight) if weight else None
+        point["pass_rate"] = round(point["success"] / point["runs"] * 100, 2) if point["runs"] else None
+        point["test_pass_rate"] = (
+            round(point["tests_passed"] / point["tests_total"] * 100, 2) if point["tests_total"] else None
+        )
+        return point
+
+    def _aggregate(self, rows) -> dict:
+        """Rollup column values from (status, duration, stats) rows of one template, env and day."""
+        values = {
+            "runs": len(rows), "success": 0, "failure": 0, "aborted": 0,
+            "tests_total": 0, "tests_passed": 0, "tests_failed": 0, "tests_skipped": 0,
+        }
+        durations = []
+        for status, duration, stats in rows:
+            values[status.value.lower()] += 1
+            if duration:
+                durations.append(duration)
+            statistic = (stats or {}).get("statistic") or {}
+            values["tests_total"] += statistic.get("total", 0)
+            values["tests_passed"] += statistic.get("passed", 0)
+            values["tests_failed"] += statistic.get("failed", 0) + statistic.get("broken", 0)
+            values["tests_skipped"] += statistic.get("skipped", 0)
+        durations.sort()
+        values["duration_p50"] = percentile(durations, 50)
+        values["duration_p95"] = percentile(durations, 95)
+        values["updated_at"] = datetime.now()
+        return values
+
+    async def _save(self, session: AsyncSession, key: RollupKey, values: dict):
+        """Update a rollup row, the caller commits; a new row is inserted and committed at once."""
+        template_id, env, day = key
+        table = ExecutionRollup.__table__
+        where = (table.c.template_id == template_id, table.c.env == env, table.c.day == day)
+        result = await session.execute(update(table).where(*where).values(**values))
+        if result.rowcount == 0:
+            # Commit the batch so far, so a conflicting insert only rolls back itself
+            await session.commit()
+            session.add(ExecutionRollup(template_id=template_id, env=env, day=day, **values))
+            try:
+                await session.commit()
+                return
+            except IntegrityError:
+                # Created concurrently by another instance
+                await session.rollback()
+                await session.execute(update(table).where(*where).values(**values))
+
+    def _day_range(self, day: date) -> Tuple[datetime, datetime]:
+        start = datetime.combine(day, time.min)
+        return start, start + timedelta(days=1)
+
+rollup_service = RollupService()
@@ -1,21 +1,114 @@
+import asyncio
+from apscheduler.job import Job
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
 from sqlmodel import select
 import logging
 from croniter import croniter
 from datetime import datetime
+from typing import Dict, Optional
 
+from app.core.config import settings
 from app.db.session import async_session
 from app.models.models import ScheduleConfig, TestTemplate, TaskExecution, TaskStatus, TriggerType
-from app.services.jenkins_service import jenkins_service
+from app.services.event_hub import event_hub
+from app.services.trigger_dispatcher import trigger_dispatcher
 
 logger = logging.getLogger(__name__)
 
+JOBS_TABLE = "apscheduler_jobs"
+
+def jobstore_url() -> str:
+    """Synchronous URL of the application database for the APScheduler job store."""
+    if settings.SCHEDULER_JOBSTORE_URL:
+        return settings.SCHEDULER_JOBSTORE_URL
+    return settings.DATABASE_URL.replace("+aiomysql", "+pymysql").replace("+aiosqlite", "")
+
+async def run_scheduled_task(template_id: int, env: str):
+    """Job entry point, module-level so the persistent job store can reference it by name."""
+    await scheduler_service.execute_scheduled_task(template_id, env)
+
 class SchedulerService:
+    """
+    Cron schedules backed by APScheduler with jobs persisted in the database.
+
+    Jobs keep their next fire time across restarts; runs missed while the process was
+    down fire on startup if they are at most SCHEDULER_MISFIRE_GRACE_TIME seconds late,
+    and several missed runs of one schedule are coalesced into one. On startup the
+    job store is reconciled with the active ScheduleConfig rows, loaded in one query, and
+    again every SCHEDULER_SYNC_INTERVAL seconds. Only the leader instance runs the
+    scheduler; on the others add_job/remove_job are no-ops and the periodic sync applies
+    their edits.
+
+    The job store is synchronous (pymysql), so this service runs its calls in a worker
+    thread: a sync reads the stored jobs once and only writes the ones that changed.
+    APScheduler's own wakeups still query the store on the event loop, one short indexed
+    query per due run.
+    """
+
     def __init__(self):
-        self.scheduler = AsyncIOScheduler()
+        self.scheduler = AsyncIOScheduler(
+            jobstores={
+                "default": SQLAlchemyJobStore(url=jobstore_url(), tablename=JOBS_TABLE),
+                # Housekeeping jobs of this instance, not persisted
+                "local": MemoryJobStore(),
+            },
+            job_defaults={
+                "coalesce": settings.SCHEDULER_COALESCE,
+                "misfire_grace_time": settings.SCHEDULER_MISFIRE_GRACE_TIME,
+                "max_instances": 1,
+            },
+        )
+
+    async def start(self):
+        """Start the scheduler and reconcile its stored jobs with the schedules in the DB."""
+        if self.scheduler.running:
+            return
         self.scheduler.start()
+        await self.sync_schedules()
+        self.scheduler.add_job(
+            self.sync_schedules,
+            "interval",
+            seconds=settings.SCHEDULER_SYNC_INTERVAL,
+            id="sync-schedules",
+            jobstore="local",
+            replace_existing=True,
+        )
+
+    def stop(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+
+    async def sync_schedules(self):
+        async with async_session() as session:
+            result = await session.execute(select(ScheduleConfig))
+            schedules = result.scalars().all()
+
+        active = {str(schedule.id): schedule for schedule in schedules if schedule.is_active}
+        stored = {job.id: job for job in await asyncio.to_thread(self.scheduler.get_jobs, jobstore="default")}
+        for job_id in stored.keys() - active.keys():
+            await self.remove_job(job_id)
+        for job_id, schedule in active.items():
+            await self._put_job(schedule, stored.get(job_id))
+        logger.info(f"Synced {len(active)} active schedules")
+
+    async def get_next_fire_times(self) -> Dict[int, Optional[datetime]]:
+        """Next fire time of every stored job, read from the job store table so any instance can answer."""
+        try:
+            async with async_session() as session:
+                result = await session.execute(text(f"SELECT id, next_run_time FROM {JOBS_TABLE}"))
+                rows = result.all()
+        except Exception as e:
+            logger.error(f"Failed to read scheduler jobs: {e}")
+            return {}
+        return {
+            int(job_id): datetime.fromtimestamp(next_run_time).astimezone() if next_run_time is not None else None
+            for job_id, next_run_time in rows
+        }
 
     def get_next_run_times(self, cron_expr: str, limit: int = 5):
         try:
@@ -26,28 +119,40 @@ class SchedulerService:
             return []
 
     async def add_job(self, schedule: ScheduleConfig):
-        # Remove existing if any
-        self.remove_job(schedule.id)
-        
+        if not self.scheduler.running:
+            # Not the leader: the leader picks the change up on its next sync
+            return
         if not schedule.is_active:
+            await self.remove_job(schedule.id)
             return
+        existing = await asyncio.to_thread(self.scheduler.get_job, str(schedule.id))
+        await self._put_job(schedule, existing)
 
+    async def _put_job(self, schedule: ScheduleConfig, existing: Optional[Job]):
+        """Store the job of an active schedule unless `existing` already matches it."""
         try:
             trigger = CronTrigger.from_crontab(schedule.cron_expression)
-            self.scheduler.add_job(
-                self.execute_scheduled_task,
+            args = [schedule.template_id, schedule.target_env]
+            if existing and str(existing.trigger) == str(trigger) and list(existing.args) == args:
+                # Unchanged: keep the stored next fire time (and any pending misfire)
+                return
+            await asyncio.to_thread(
+                self.scheduler.add_job,
+                run_scheduled_task,
                 trigger=trigger,
                 id=str(schedule.id),
-                args=[schedule.template_id, schedule.target_env],
+                args=args,
                 replace_existing=True
             )
             logger.info(f"Added job for schedule {schedule.id}")
         except Exception as e:
             logger.error(f"Failed to add job {schedule.id}: {e}")
 
-    def remove_job(self, schedule_id: int):
+    async def remove_job(self, schedule_id: int):
+        if not self.scheduler.running:
+            return
         try:
-            self.scheduler.remove_job(str(schedule_id))
+            await asyncio.to_thread(self.scheduler.remove_job, str(schedule_id))
             logger.info(f"Removed job {schedule_id}")
         except Exception:
             pass 
@@ -60,23 +165,19 @@ class SchedulerService:
                 logger.error(f"Template {template_id} not found during execution")
                 return
 
-            # Create Execution
+            # Create Execution and its outbox entry; the trigger dispatcher calls Jenkins
             execution = TaskExecution(
                 template_id=template.id,
-                status=TaskStatus.QUEUED,
+                status=TaskStatus.PENDING,
                 trigger_type=TriggerType.SCHEDULE,
+                execution_env=env,
                 stats={"env": env}
             )
             session.add(execution)
+            await session.flush()
+            trigger_dispatcher.enqueue(session, execution, template.jenkins_job_name, {"env": env})
             await session.commit()
-            await session.refresh(execution)
-
-            # Trigger Jenkins
-            params = {"env": env}
-            success = await jenkins_service.trigger_job(template.jenkins_job_name, params)
-            if not success:
-                 execution.status = TaskStatus.FAILURE
-                 session.add(execution)
-                 await session.commit()
+            event_hub.publish_execution("execution.created", execution)
+            trigger_dispatcher.notify()
 
 scheduler_service = SchedulerService()
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import and_, delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+
+from app.core.config import settings
+from app.db.session import async_session
+from app.models.models import PollerShard, PollerWorker
+from app.services.leader_service import leader_elector
+
+logger = logging.getLogger(__name__)
+
+
+class ShardCoordinator:
+    """
+    Spreads the poller shards over the live poller workers.
+
+    Each worker heartbeats its PollerWorker row, works out its share from the sorted list
+    of live workers (shard i goes to worker i % number of workers), releases shards it no
+    longer wants and leases the ones it wants once they are free. Leases expire after
+    POLLER_SHARD_LEASE_TTL, so the shards of a dead worker move to the others; a joining
+    worker gets its share as soon as the current owners release it on their next heartbeat.
+    """
+
+    def __init__(self):
+        self.worker_id = leader_elector.instance_id
+        self.owned: Set[int] = set()
+        self._loop_task: Optional[asyncio.Task] = None
+        # shard id -> {"tracked_tasks", "lag_ms"} of the last poll cycle
+        self._stats: Dict[int, dict] = {}
+        self.metrics = {"rebalances": 0, "heartbeat_errors": 0}
+
+    async def start(self):
+        if self._loop_task is not None:
+            return
+        await self.heartbeat()
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        await self._leave()
+
+    def shard_of(self, template_id: int) -> int:
+        return template_id % settings.POLLER_SHARDS
+
+    def report(self, stats: Dict[int, dict]):
+        """Per-shard statistics of the last poll cycle, written on the next heartbeat."""
+        self._stats = stats
+
+    async def get_shards(self) -> List[dict]:
+        async with async_session() as session:
+            result = await session.execute(select(PollerShard).order_by(PollerShard.shard_id))
+            shards = result.scalars().all()
+        now = datetime.now()
+        return [
+            {
+                "shard_id": shard.shard_id,
+                "owner": shard.owner if shard.expires_at and shard.expires_at > now else None,
+                "tracked_tasks": shard.tracked_tasks,
+                "lag_ms": shard.lag_ms,
+                "updated_at": shard.updated_at,
+            }
+            for shard in shards if shard.shard_id < settings.POLLER_SHARDS
+        ]
+
+    def get_metrics(self) -> dict:
+        return {**self.metrics, "worker_id": self.worker_id, "owned_shards": sorted(self.owned)}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.POLLER_SHARD_HEARTBEAT)
+            await self.heartbeat()
+
+    async def heartbeat(self):
+        try:
+            owned = await self._rebalance()
+        except Exception as e:
+            self.metrics["heartbeat_errors"] += 1
+            logger.error(f"Poller shard heartbeat failed: {e}")
+            # Our leases lapse if we cannot renew them; stop polling before someone else starts
+            owned = set()
+        if owned != self.owned:
+            self.metrics["rebalances"] += 1
+            logger.info(f"Poller worker {self.worker_id} now owns shards {sorted(owned)}")
+        self.owned = owned
+
+    async def _rebalance(self) -> Set[int]:
+        now = datetime.now()
+        ttl = timedelta(seconds=settings.POLLER_SHARD_LEASE_TTL)
+        shards = range(settings.POLLER_SHARDS)
+        table = PollerShard.__table__
+
+        async with async_session() as session:
+            # 1. Register this worker and the shard rows
+            await self._upsert_worker(session, now)
+            result = await session.execute(select(table.c.shard_id))
+            missing = set(shards) - {row.shard_id for row in result}
+            if missing:
+                session.add_all([PollerShard(shard_id=shard_id) for shard_id in missing])
+                try:
+                    await session.commit()
+                except IntegrityError:
+                    await session.rollback()
+
+            # 2. Our share: shard i belongs to live worker i % len(live workers)
+            result = await session.execute(
+                select(PollerWorker.worker_id).where(PollerWorker.heartbeat_at > now - ttl).order_by(PollerWorker.worker_id)
+            )
+            workers = [row.worker_id for row in result] or [self.worker_id]
+            index = workers.index(self.worker_id) if self.worker_id in workers else 0
+            wanted = [shard_id for shard_id in shards if shard_id % len(workers) == index]
+
+            # 3. Hand back shards we no longer want, take the wanted ones that are free
+            await session.execute(
+                update(table)
+                .where(table.c.owner == self.worker_id, table.c.shard_id.notin_(wanted))
+                .values(owner=None, expires_at=None)
+            )
+            if wanted:
+                await session.execute(
+                    update(table)
+                    .where(
+                        table.c.shard_id.in_(wanted),
+                        or_(table.c.owner == self.worker_id, table.c.owner.is_(None), table.c.expires_at < now),
+                    )
+                    .values(owner=self.worker_id, expires_at=now + ttl)
+                )
+            for shard_id, stats in self._stats.items():
+                await session.execute(
+                    update(table)
+                    .where(table.c.shard_id == shard_id, table.c.owner == self.worker_id)
+                    .values(tracked_tasks=stats["tracked_tasks"], lag_ms=stats["lag_ms"], updated_at=now)
+                )
+            # Forget workers that have been gone for a long time
+            await session.execute(delete(PollerWorker).where(PollerWorker.heartbeat_at < now - 10 * ttl))
+            await session.commit()
+
+            result = await session.execute(
+                select(table.c.shard_id).where(and_(table.c.owner == self.worker_id, table.c.expires_at > now))
+            )
+            return {row.shard_id for row in result}
+
+    async def _upsert_worker(self, session, now: datetime):
+        result = await session.execute(
+            update(PollerWorker.__table__)
+            .where(PollerWorker.__table__.c.worker_id == self.worker_id)
+            .values(heartbeat_at=now)
+        )
+        if result.rowcount == 0:
+            session.add(PollerWorker(worker_id=self.worker_id, heartbeat_at=now))
+        await session.commit()
+
+    async def _leave(self):
+        """Deregister and release our shards so the remaining workers take them over at once."""
+        self.owned = set()
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    update(PollerShard.__table__)
+                    .where(PollerShard.__table__.c.owner == self.worker_id)
+                    .values(owner=None, expires_at=None)
+                )
+                await session.execute(delete(PollerWorker).where(PollerWorker.worker_id == self.worker_id))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Failed to release poller shards: {e}")
+
+shard_coordinator = ShardCoordinator()
@@ -0,0 +1,162 @@
+import hashlib
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import and_, case, delete, func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.core.config import settings
+from app.models.models import TaskExecution, TestCaseResult
+
+
+class TestResultService:
+    """
+    Per-test-case results of executions and the queries over their history.
+
+    Rows are written in batched INSERTs when an execution's Allure report is ingested.
+    History, flakiness and slowest-test rankings are aggregated in SQL; flakiness uses
+    window functions (MySQL 8 / SQLite 3.25 or later).
+    """
+
+    def parse_cases(self, suites: dict) -> List[dict]:
+        """Leaves of the Allure suites tree as {test_id, name, suite, full_name, status, duration}."""
+        cases = []
+        for suite in suites.get("children", []):
+            self._collect(suite, [], suite.get("name"), cases)
+        return cases
+
+    def _collect(self, node: dict, path: List[str], suite: str, cases: List[dict]):
+        children = node.get("children")
+        if children is not None:
+            for child in children:
+                self._collect(child, path + [node.get("name") or ""], suite, cases)
+            return
+        name = node.get("name") or ""
+        full_name = " / ".join(path + [name])
+        if node.get("parameters"):
+            full_name += f" [{', '.join(str(p) for p in node['parameters'])}]"
+        cases.append({
+            "test_id": hashlib.sha1(full_name.encode("utf-8")).hexdigest(),
+            "name": name[:255],
+            "suite": (suite or "")[:255] or None,
+            "full_name": full_name,
+            "status": node.get("status") or "unknown",
+            "duration": (node.get("time") or {}).get("duration"),
+        })
+
+    async def store(self, session: AsyncSession, execution: TaskExecution, cases: List[dict]):
+        """Replace an execution's test-case rows; the caller commits."""
+        table = TestCaseResult.__table__
+        await session.execute(delete(table).where(table.c.execution_id == execution.id))
+        rows = [
+            {**test_case, "execution_id": execution.id, "template_id": execution.template_id, "run_at": execution.start_time}
+            for test_case in cases
+        ]
+        batch = settings.ALLURE_TEST_CASE_BATCH
+        for i in range(0, len(rows), batch):
+            await session.execute(insert(table), rows[i:i + batch])
+
+    async def get_history(self, session: AsyncSession, template_id: int, test_id: str, limit: int) -> List[dict]:
+        """The last `limit` results of one test, newest first."""
+        table = TestCaseResult.__table__
+        result = await session.execute(
+            select(
+                table.c.execution_id, TaskExecution.build_number, table.c.run_at,
+                table.c.status, table.c.duration, table.c.name, table.c.full_name,
+            )
+            .join(TaskExecution, TaskExecution.id == table.c.execution_id)
+            .where(table.c.template_id == template_id, table.c.test_id == test_id)
+            .order_by(table.c.run_at.desc(), table.c.id.desc())
+            .limit(limit)
+        )
+        return [dict(row._mapping) for row in result]
+
+    async def get_flaky(
+        self, session: AsyncSession, template_id: int, days: int, runs: int, min_runs: int, limit: int
+    ) -> List[dict]:
+        """
+        Tests ranked by flip rate: the share of consecutive runs whose outcome changed.
+
+        Only the last `runs` passed/failed/broken results of each test within `days` are
+        considered, with broken counted as failed.
+        """
+        table = TestCaseResult.__table__
+        outcome = case((table.c.status == "passed", "passed"), else_="failed")
+        recent = (
+            select(
+                table.c.test_id, table.c.run_at, table.c.id, outcome.label("outcome"),
+                func.row_number().over(
+                    partition_by=table.c.test_id, order_by=(table.c.run_at.desc(), table.c.id.desc())
+                ).label("rn"),
+            )
+            .where(
+                table.c.template_id == template_id,
+                table.c.run_at >= datetime.now() - timedelta(days=days),
+                table.c.status.in_(("passed", "failed", "broken")),
+            )
+            .subquery()
+        )
+        ordered = (
+            select(
+                recent.c.test_id, recent.c.outcome,
+                func.lag(recent.c.outcome).over(
+                    partition_by=recent.c.test_id, order_by=(recent.c.run_at, recent.c.id)
+                ).label("previous"),
+            )
+            .where(recent.c.rn <= runs)
+            .subquery()
+        )
+        count = func.count()
+        failures = func.sum(case((ordered.c.outcome == "failed", 1), else_=0))
+        flips = func.sum(case((and_(ordered.c.previous.isnot(None), ordered.c.previous != ordered.c.outcome), 1), else_=0))
+        flip_rate = flips * 1.0 / (count - 1)
+        result = await session.execute(
+            select(
+                ordered.c.test_id, count.label("runs"), failures.label("failures"),
+                flips.label("flips"), flip_rate.label("flip_rate"),
+            )
+            .group_by(ordered.c.test_id)
+            .having(and_(count >= max(min_runs, 2), flips > 0))
+            .order_by(flip_rate.desc(), count.desc())
+            .limit(limit)
+        )
+        rows = [dict(row._mapping) for row in result]
+        return await self._with_names(session, template_id, rows)
+
+    async def get_slowest(self, session: AsyncSession, template_id: int, days: int, limit: int) -> List[dict]:
+        """Tests ranked by average duration within `days`."""
+        table = TestCaseResult.__table__
+        avg_duration = func.avg(table.c.duration)
+        result = await session.execute(
+            select(
+                table.c.test_id, func.count().label("runs"),
+                avg_duration.label("avg_duration"), func.max(table.c.duration).label("max_duration"),
+            )
+            .where(
+                table.c.template_id == template_id,
+                table.c.run_at >= datetime.now() - timedelta(days=days),
+                table.c.duration.isnot(None),
+            )
+            .group_by(table.c.test_id)
+            .order_by(avg_duration.desc())
+            .limit(limit)
+        )
+        rows = [dict(row._mapping) for row in result]
+        return await self._with_names(session, template_id, rows)
+
+    async def _with_names(self, session: AsyncSession, template_id: int, rows: List[dict]) -> List[dict]:
+        if not rows:
+            return rows
+        table = TestCaseResult.__table__
+        result = await session.execute(
+            select(table.c.test_id, func.max(table.c.name), func.max(table.c.suite))
+            .where(table.c.template_id == template_id, table.c.test_id.in_([row["test_id"] for row in rows]))
+            .group_by(table.c.test_id)
+        )
+        names = {test_id: (name, suite) for test_id, name, suite in result.all()}
+        for row in rows:
+            row["name"], row["suite"] = names.get(row["test_id"], (None, None))
+        return rows
+
+test_result_service = TestResultService()
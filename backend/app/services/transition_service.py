@@ -0,0 +1,136 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from sqlalchemy import and_, case, literal, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import TaskExecution, TaskStatus, TestTemplate
+from app.services.allure_service import allure_service
+from app.services.cache_service import catalog_cache
+from app.services.event_hub import event_hub
+from app.services.jenkins_service import jenkins_service
+from app.services.notification_dispatcher import notification_dispatcher
+from app.services.rollup_service import rollup_service
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Transition:
+    """A pending status change of one execution, guarded by the status it was read in."""
+    task: TaskExecution
+    template: TestTemplate
+    from_status: TaskStatus
+    values: Dict[str, Any] = field(default_factory=dict)
+
+
+FINISHED_STATUSES = (TaskStatus.SUCCESS, TaskStatus.FAILURE, TaskStatus.ABORTED)
+
+
+class TransitionService:
+    def completion_values(self, template: TestTemplate, build_number: int, build_info: dict) -> dict:
+        """Column values for an execution whose Jenkins build has finished."""
+        result_str = build_info.get("result", "UNKNOWN")
+
+        if result_str == "SUCCESS":
+            status = TaskStatus.SUCCESS
+        elif result_str == "FAILURE":
+            status = TaskStatus.FAILURE
+        elif result_str == "ABORTED":
+            status = TaskStatus.ABORTED
+        else:
+            status = TaskStatus.FAILURE
+
+        jenkins_url = jenkins_service.base_url
+
+        return {
+            "status": status,
+            "duration": build_info.get("duration", 0),
+            "allure_report_url": f"{jenkins_url}/job/{jenkins_service.job_path(template.jenkins_job_name)}/{build_number}/allure/",
+        }
+
+    async def apply(self, session: AsyncSession, transitions: List[Transition]) -> List[Transition]:
+        """
+        Persist a batch of transitions in one transaction and return the ones that applied.
+
+        Rows whose status no longer matches `from_status` (e.g. changed by a concurrent
+        trigger or another poller) are left untouched. Applied values are copied onto the
+        in-memory tasks after the commit so callers can notify from them.
+        """
+        if not transitions:
+            return []
+
+        table = TaskExecution.__table__
+        by_id = {t.task.id: t for t in transitions}
+
+        # Lock the rows and keep only those still in the status we read them in
+        result = await session.execute(
+            select(table.c.id, table.c.status).where(table.c.id.in_(by_id)).with_for_update()
+        )
+        applied = [by_id[row.id] for row in result if row.status == by_id[row.id].from_status]
+        if not applied:
+            await session.rollback()
+            return []
+
+        # One UPDATE for the whole batch: every column becomes CASE id WHEN ... THEN ... END
+        columns = {key for t in applied for key in t.values}
+        values = {}
+        for column in columns:
+            col = table.c[column]
+            whens = {t.task.id: literal(t.values[column], col.type) for t in applied if column in t.values}
+            values[column] = case(whens, value=table.c.id, else_=col)
+
+        guard = or_(*[and_(table.c.id == t.task.id, table.c.status == t.from_status) for t in applied])
+        await session.execute(update(table).where(guard).values(values))
+        await session.commit()
+
+        for t in applied:
+            for key, value in t.values.items():
+                setattr(t.task, key, value)
+        return applied
+
+    async def on_applied(self, session: AsyncSession, applied: List[Transition]):
+        """Follow-up work for committed transitions: live events, analytics rollups, report ingestion and notifications."""
+        for t in applied:
+            if "status" in t.values or "queue_position" in t.values:
+                event_hub.publish_execution("execution.updated", t.task)
+
+        rollup_service.enqueue(t.task for t in applied if t.task.status in FINISHED_STATUSES)
+
+        # Items cancelled while still in the Jenkins queue never built and are not reported
+        finished = [t for t in applied if t.task.status in FINISHED_STATUSES and t.task.build_number]
+        for t in finished:
+            allure_service.enqueue(t.task.id, t.template.jenkins_job_name, t.task.build_number, t.task.allure_report_url)
+
+        notif_ids = {
+            notif_id
+            for t in finished if t.task.should_notify
+            for notif_id in t.template.notification_ids or []
+        }
+        configs = await catalog_cache.get_notification_configs(session, notif_ids)
+        for transition in finished:
+            self._trigger_notification(transition.task, transition.template, configs)
+
+    def _trigger_notification(self, task: TaskExecution, template: TestTemplate, configs: dict):
+        if not task.should_notify:
+            return
+
+        if not template.notification_ids:
+            return
+
+        item = {
+            "execution_id": task.id,
+            "template_name": template.name,
+            "build_number": task.build_number,
+            "status": task.status.value,
+            "duration": task.duration,
+            "env": task.execution_env,
+            "report_url": task.allure_report_url,
+        }
+        for notif_id in template.notification_ids:
+            config = configs.get(notif_id)
+            if config:
+                notification_dispatcher.enqueue_finished(config, item)
+
+transition_service = TransitionService()
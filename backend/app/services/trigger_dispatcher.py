@@ -0,0 +1,376 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.core.config import settings
+from app.db.session import async_session
+from app.models.models import OutboxStatus, TaskExecution, TaskStatus, TestTemplate, TriggerOutbox
+from app.services.cache_service import catalog_cache
+from app.services.jenkins_service import jenkins_service
+from app.services.transition_service import Transition, transition_service
+
+logger = logging.getLogger(__name__)
+
+
+class TriggerDispatcher:
+    """
+    Sends Jenkins build triggers from the TriggerOutbox table.
+
+    Request handlers and the scheduler only insert a PENDING execution plus its outbox row
+    in one transaction; this dispatcher claims due rows, triggers them with bounded
+    concurrency (overall and per Jenkins job), and moves the execution to QUEUED with
+    its queue URL. Failed triggers are retried with exponential backoff and the execution
+    is marked FAILURE once OUTBOX_MAX_ATTEMPTS is reached.
+
+    Rows are only claimed while the build caps allow it (MAX_CONCURRENT_BUILDS,
+    MAX_CONCURRENT_BUILDS_PER_JOB and TestTemplate.max_concurrent, counting QUEUED and
+    RUNNING executions); the rest stay PENDING until earlier builds finish.
+
+    Rows claimed by a process that died are released after OUTBOX_CLAIM_TIMEOUT, and a row
+    whose execution already left PENDING is never sent again. Every trigger carries its
+    idempotency key as the OUTBOX_TRIGGER_KEY_PARAM build parameter; a row that was tried
+    before (a failed attempt or a released claim) is first looked up in the Jenkins queue
+    and recent builds, and a build found there is recorded instead of triggering another.
+    """
+
+    def __init__(self):
+        self.running = False
+        self._loop_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight: Set[int] = set()
+        self._in_flight_by_job: Dict[str, int] = defaultdict(int)
+        self._in_flight_by_template: Dict[int, int] = defaultdict(int)
+        self._tasks: Set[asyncio.Task] = set()
+        self.metrics = {"triggered": 0, "retried": 0, "failed": 0, "skipped": 0, "released": 0, "recovered": 0}
+        # Refreshed every claim cycle
+        self._depth = {
+            "pending": 0, "waiting_for_capacity": 0, "active_builds": 0,
+            "waiting_by_cap": {"global": 0, "job": 0, "template": 0},
+        }
+        self._wait = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    async def start(self):
+        if self._loop_task is not None:
+            return
+        self.running = True
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(settings.OUTBOX_CONCURRENCY)
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.running = False
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        # Let triggers already sent to Jenkins record their result
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=settings.JENKINS_TIMEOUT)
+
+    def notify(self):
+        """Wake the dispatcher after new outbox rows were committed."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def get_metrics(self) -> dict:
+        return {
+            **self.metrics,
+            **self._depth,
+            "in_flight": len(self._in_flight),
+            "in_flight_by_job": {job: n for job, n in self._in_flight_by_job.items() if n},
+            "avg_wait_ms": round(self._wait["total_ms"] / self._wait["count"], 1) if self._wait["count"] else 0.0,
+            "max_wait_ms": round(self._wait["max_ms"], 1),
+        }
+
+    def enqueue(
+        self,
+        session: AsyncSession,
+        execution: TaskExecution,
+        job_name: str,
+        params: dict,
+        idempotency_key: Optional[str] = None,
+    ) -> TriggerOutbox:
+        """Add the outbox row of a flushed execution to the caller's transaction."""
+        entry = TriggerOutbox(
+            execution_id=execution.id,
+            idempotency_key=idempotency_key or f"execution-{execution.id}",
+            job_name=job_name,
+            params=params,
+        )
+        session.add(entry)
+        return entry
+
+    async def _run(self):
+        logger.info("Trigger dispatcher started")
+        while self.running:
+            try:
+                await self.dispatch_due()
+            except Exception as e:
+                logger.error(f"Error in trigger dispatcher loop: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def dispatch_due(self):
+        """Claim the outbox rows that are due and start sending them."""
+        async with async_session() as session:
+            await self._release_stale_claims(session)
+            entries = await self._claim(session)
+
+        for entry, template_id in entries:
+            self._in_flight.add(entry.id)
+            self._in_flight_by_job[entry.job_name] += 1
+            self._in_flight_by_template[template_id] += 1
+            task = asyncio.create_task(self._dispatch(entry, template_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _release_stale_claims(self, session: AsyncSession):
+        table = TriggerOutbox.__table__
+        cutoff = datetime.now() - timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT)
+        result = await session.execute(
+            update(table)
+            .where(table.c.status == OutboxStatus.IN_FLIGHT, table.c.claimed_at < cutoff)
+            # The dead process may have reached Jenkins: count it as an attempt so the resend looks first
+            .values(
+                status=OutboxStatus.PENDING, claimed_at=None,
+                attempts=table.c.attempts + 1, last_error="Claim released",
+            )
+        )
+        await session.commit()
+        if result.rowcount:
+            self.metrics["released"] += result.rowcount
+            logger.warning(f"Released {result.rowcount} stale trigger claims")
+
+    async def _claim(self, session: AsyncSession) -> List[Tuple[TriggerOutbox, int]]:
+        """
+        Mark due rows IN_FLIGHT, within the dispatch and build limits; returns (row, template id) pairs.
+
+        Templates and jobs at their cap (and jobs at OUTBOX_MAX_IN_FLIGHT_PER_JOB) are excluded
+        in the query, so held rows never fill the batch and starve other templates. A cap
+        reached while claiming excludes its rows from the next pass.
+        """
+        by_template, by_job, total = await self._active_builds(session)
+        # Pending rows per (template, job): total depth and how many each cap holds back
+        result = await session.execute(
+            select(TaskExecution.template_id, TriggerOutbox.job_name, func.count())
+            .join(TaskExecution, TaskExecution.id == TriggerOutbox.execution_id)
+            .where(TriggerOutbox.status == OutboxStatus.PENDING)
+            .group_by(TaskExecution.template_id, TriggerOutbox.job_name)
+        )
+        pending_groups = result.all()
+        templates = await catalog_cache.get_templates(
+            session, set(by_template) | {template_id for template_id, _, _ in pending_groups}
+        )
+
+        free = settings.OUTBOX_CONCURRENCY - len(self._in_flight)
+        dispatching = dict(self._in_flight_by_job)
+        claimed: List[Tuple[TriggerOutbox, int]] = []
+        while pending_groups and len(claimed) < free:
+            global_full, full_templates, full_jobs = self._saturated(templates, by_template, by_job, total)
+            if global_full:
+                break
+            throttled = {job for job, n in dispatching.items() if n >= settings.OUTBOX_MAX_IN_FLIGHT_PER_JOB}
+            statement = (
+                select(TriggerOutbox, TaskExecution.template_id)
+                .join(TaskExecution, TaskExecution.id == TriggerOutbox.execution_id)
+                .where(TriggerOutbox.status == OutboxStatus.PENDING, TriggerOutbox.next_attempt_at <= datetime.now())
+            )
+            if full_templates:
+                statement = statement.where(TaskExecution.template_id.notin_(full_templates))
+            if full_jobs | throttled:
+                statement = statement.where(TriggerOutbox.job_name.notin_(full_jobs | throttled))
+            if claimed:
+                statement = statement.where(TriggerOutbox.id.notin_([entry.id for entry, _ in claimed]))
+            result = await session.execute(
+                statement.order_by(TriggerOutbox.next_attempt_at, TriggerOutbox.id).limit(settings.OUTBOX_BATCH_SIZE)
+            )
+            rows = result.all()
+
+            held = False
+            for entry, template_id in rows:
+                if len(claimed) >= free:
+                    break
+                template = templates.get(template_id)
+                template_cap = template.max_concurrent if template else None
+                if (
+                    dispatching.get(entry.job_name, 0) >= settings.OUTBOX_MAX_IN_FLIGHT_PER_JOB
+                    or (settings.MAX_CONCURRENT_BUILDS and total >= settings.MAX_CONCURRENT_BUILDS)
+                    or (settings.MAX_CONCURRENT_BUILDS_PER_JOB and by_job[entry.job_name] >= settings.MAX_CONCURRENT_BUILDS_PER_JOB)
+                    or (template_cap and by_template[template_id] >= template_cap)
+                ):
+                    # Saturated by this pass's claims: excluded by the next query
+                    held = True
+                    continue
+                dispatching[entry.job_name] = dispatching.get(entry.job_name, 0) + 1
+                by_template[template_id] += 1
+                by_job[entry.job_name] += 1
+                total += 1
+                session.expunge(entry)
+                claimed.append((entry, template_id))
+            if not held and len(rows) < settings.OUTBOX_BATCH_SIZE:
+                break
+
+        self._update_depth(pending_groups, claimed, *self._saturated(templates, by_template, by_job, total))
+        if not claimed:
+            return []
+
+        table = TriggerOutbox.__table__
+        now = datetime.now()
+        await session.execute(
+            update(table)
+            .where(table.c.id.in_([entry.id for entry, _ in claimed]), table.c.status == OutboxStatus.PENDING)
+            .values(status=OutboxStatus.IN_FLIGHT, claimed_at=now)
+        )
+        await session.commit()
+        return claimed
+
+    def _saturated(
+        self, templates: Dict[int, TestTemplate], by_template: Dict[int, int], by_job: Dict[str, int], total: int
+    ) -> Tuple[bool, Set[int], Set[str]]:
+        """Whether the global cap is reached, and the templates and jobs at their cap."""
+        global_full = bool(settings.MAX_CONCURRENT_BUILDS and total >= settings.MAX_CONCURRENT_BUILDS)
+        full_jobs = {
+            job for job, n in by_job.items()
+            if settings.MAX_CONCURRENT_BUILDS_PER_JOB and n >= settings.MAX_CONCURRENT_BUILDS_PER_JOB
+        }
+        full_templates = set()
+        for template_id, n in by_template.items():
+            template = templates.get(template_id)
+            if template and template.max_concurrent and n >= template.max_concurrent:
+                full_templates.add(template_id)
+        return global_full, full_templates, full_jobs
+
+    def _update_depth(self, pending_groups, claimed, global_full: bool, full_templates: Set[int], full_jobs: Set[str]):
+        claimed_by_group: Dict[Tuple[int, str], int] = defaultdict(int)
+        for entry, template_id in claimed:
+            claimed_by_group[(template_id, entry.job_name)] += 1
+        waiting = {"global": 0, "job": 0, "template": 0}
+        pending = 0
+        for template_id, job_name, n in pending_groups:
+            n -= claimed_by_group[(template_id, job_name)]
+            pending += n
+            if global_full:
+                waiting["global"] += n
+            elif job_name in full_jobs:
+                waiting["job"] += n
+            elif template_id in full_templates:
+                waiting["template"] += n
+        self._depth["pending"] = pending
+        self._depth["waiting_for_capacity"] = sum(waiting.values())
+        self._depth["waiting_by_cap"] = waiting
+
+    async def _active_builds(self, session: AsyncSession) -> Tuple[Dict[int, int], Dict[str, int], int]:
+        """Builds in Jenkins (QUEUED/RUNNING) plus triggers being sent, per template, per job and in total."""
+        result = await session.execute(
+            select(TaskExecution.template_id, func.count())
+            .where(TaskExecution.status.in_([TaskStatus.QUEUED, TaskStatus.RUNNING]))
+            .group_by(TaskExecution.template_id)
+        )
+        by_template: Dict[int, int] = defaultdict(int, self._in_flight_by_template)
+        for template_id, count in result.all():
+            by_template[template_id] += count
+        templates = await catalog_cache.get_templates(session, [tid for tid, n in by_template.items() if n])
+        by_job: Dict[str, int] = defaultdict(int)
+        for template_id, count in by_template.items():
+            if template_id in templates:
+                by_job[templates[template_id].jenkins_job_name] += count
+        total = sum(by_template.values())
+        self._depth["active_builds"] = total
+        return by_template, by_job, total
+
+    async def _dispatch(self, entry: TriggerOutbox, template_id: int):
+        try:
+            async with self._semaphore:
+                await self._send(entry)
+        except Exception as e:
+            logger.error(f"Error dispatching trigger {entry.id}: {e}")
+        finally:
+            self._in_flight.discard(entry.id)
+            self._in_flight_by_job[entry.job_name] -= 1
+            self._in_flight_by_template[template_id] -= 1
+            self.notify()
+
+    async def _send(self, entry: TriggerOutbox):
+        async with async_session() as session:
+            execution = await session.get(TaskExecution, entry.execution_id)
+            if execution is None or execution.status != TaskStatus.PENDING:
+                # Already sent before a crash (or removed): never trigger twice
+                self.metrics["skipped"] += 1
+                await self._finish(session, entry, OutboxStatus.DONE)
+                return
+            session.expunge(execution)
+            templates = await catalog_cache.get_templates(session, [execution.template_id])
+            template = templates.get(execution.template_id)
+
+            queue_url = await self._trigger(entry)
+            if queue_url:
+                values = {"status": TaskStatus.QUEUED, "jenkins_queue_item_url": queue_url}
+                applied = await transition_service.apply(session, [Transition(execution, template, TaskStatus.PENDING, values)])
+                await transition_service.on_applied(session, applied)
+                await self._finish(session, entry, OutboxStatus.DONE)
+                self.metrics["triggered"] += 1
+                waited_ms = (datetime.now() - entry.created_at).total_seconds() * 1000
+                self._wait["count"] += 1
+                self._wait["total_ms"] += waited_ms
+                self._wait["max_ms"] = max(self._wait["max_ms"], waited_ms)
+                return
+
+            entry.attempts += 1
+            if entry.attempts < settings.OUTBOX_MAX_ATTEMPTS:
+                delay = settings.OUTBOX_RETRY_DELAY * (2 ** (entry.attempts - 1))
+                await self._finish(
+                    session, entry, OutboxStatus.PENDING,
+                    next_attempt_at=datetime.now() + timedelta(seconds=delay),
+                )
+                self.metrics["retried"] += 1
+                return
+
+            values = {"status": TaskStatus.FAILURE, "duration": 0}
+            applied = await transition_service.apply(session, [Transition(execution, template, TaskStatus.PENDING, values)])
+            await transition_service.on_applied(session, applied)
+            await self._finish(session, entry, OutboxStatus.FAILED)
+            self.metrics["failed"] += 1
+            logger.warning(f"Giving up on triggering {entry.job_name} for execution {entry.execution_id}")
+
+    async def _trigger(self, entry: TriggerOutbox) -> Optional[str]:
+        """Queue URL of the row's build, triggering it unless an earlier attempt already did."""
+        key_param = settings.OUTBOX_TRIGGER_KEY_PARAM
+        if entry.attempts:
+            try:
+                queue_url = await jenkins_service.find_triggered(entry.job_name, key_param, entry.idempotency_key)
+            except Exception as e:
+                # Unknown whether the earlier attempt got through: retry later rather than risk a duplicate
+                logger.warning(f"Could not look up earlier triggers of execution {entry.execution_id}: {e}")
+                return None
+            if queue_url:
+                self.metrics["recovered"] += 1
+                return queue_url
+        return await jenkins_service.trigger_job(entry.job_name, {**(entry.params or {}), key_param: entry.idempotency_key})
+
+    async def _finish(self, session: AsyncSession, entry: TriggerOutbox, status: OutboxStatus, **values):
+        table = TriggerOutbox.__table__
+        failed = status != OutboxStatus.DONE
+        await session.execute(
+            update(table)
+            .where(table.c.id == entry.id)
+            .values(
+                status=status,
+                attempts=entry.attempts,
+                claimed_at=None,
+                last_error="Jenkins trigger failed" if failed else None,
+                **values,
+            )
+        )
+        await session.commit()
+
+trigger_dispatcher = TriggerDispatcher()
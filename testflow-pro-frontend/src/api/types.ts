@@ -7,6 +7,7 @@ export interface TestTemplate {
   description?: string;
   params?: string;
   auto_notify?: boolean;
+  max_concurrent?: number | null; // max builds queued/running at once, empty = unlimited
 }
 
 export interface TaskStatsDetail {
@@ -32,7 +33,7 @@ export interface TaskStats {
   statistic?: TaskStatsDetail;
 }
 
-export type TaskStatus = 'QUEUED' | 'RUNNING' | 'SUCCESS' | 'FAILURE' | 'ABORTED';
+export type TaskStatus = 'PENDING' | 'QUEUED' | 'RUNNING' | 'SUCCESS' | 'FAILURE' | 'ABORTED';
 
 export interface TaskExecution {
   id: number;
@@ -49,6 +50,8 @@ export interface TaskExecution {
   stats?: TaskStats; // Made optional and updated structure
   should_notify?: boolean;
   jenkins_queue_item_url?: string;
+  queue_position?: number | null;
+  queue_reason?: string | null;
   progress?: number;
 }
 